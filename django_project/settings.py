@@ -94,6 +94,22 @@ DATABASES = {
     'default': env.dj_db_url("DATABASE_URL", default="sqlite:///db.sqlite3"),
 }
 
+# With Redis, cached settings and reports are shared by every worker and invalidated through it; without it each
+# worker keeps its own copies for a short while (see operations.singletons)
+if env.str("REDIS_URL", default=""):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': env.str("REDIS_URL"),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import ExpenseCategory, Expense, Customer, RecyclingOperation, AccountPayable, Payment, Operator, \
-    Manager, Packer, ElectricityConfiguration, SalaryManager, SalaryOperator, SalaryPacker, GeneralExpensesAccount, \
-    CustomerIn, InitialMeterReading, Electricity, Transaction, FlakesIn, FlakesCost, PelletsPrice
+from .models import ExpenseCategory, Expense, Customer, RecyclingOperation, AccountPayable, Payment, Staff, \
+    ElectricityConfiguration, Salary, SalaryPayment, GeneralExpensesAccount, \
+    CustomerIn, InitialMeterReading, Electricity, Transaction, FlakesIn, FlakesCost, PelletsPrice, BalanceCheckpoint, \
+    ElectricityTariff, PayrollPeriod, PayrollStatement
 
 
 @admin.register(ExpenseCategory)
@@ -16,19 +17,34 @@ class ExpenseAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'description')
 
 
-@admin.register(Operator)
+@admin.register(Staff)
 class StaffAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'phone_number', 'address')
+    list_display = ('name', 'role', 'email', 'phone_number', 'address')
+    list_filter = ('role',)
+    search_fields = ('name',)
 
 
-@admin.register(Manager)
-class StaffAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'phone_number', 'address')
+@admin.register(ElectricityTariff)
+class ElectricityTariffAdmin(admin.ModelAdmin):
+    list_display = ('effective_from', 'cost_per_unit')
 
 
-@admin.register(Packer)
-class StaffAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'phone_number', 'address')
+class PayrollStatementInline(admin.TabularInline):
+    model = PayrollStatement
+    extra = 0
+    can_delete = False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PayrollPeriod)
+class PayrollPeriodAdmin(admin.ModelAdmin):
+    list_display = ('start', 'end', 'closed_at')
+    inlines = [PayrollStatementInline]
 
 
 admin.site.register(RecyclingOperation)
@@ -36,9 +52,8 @@ admin.site.register(ElectricityConfiguration)
 admin.site.register(Customer)
 admin.site.register(Payment)
 admin.site.register(AccountPayable)
-admin.site.register(SalaryManager)
-admin.site.register(SalaryOperator)
-admin.site.register(SalaryPacker)
+admin.site.register(Salary)
+admin.site.register(SalaryPayment)
 admin.site.register(GeneralExpensesAccount)
 admin.site.register(CustomerIn)
 admin.site.register(InitialMeterReading)
@@ -46,4 +61,5 @@ admin.site.register(Electricity)
 admin.site.register(Transaction)
 admin.site.register(FlakesIn)
 admin.site.register(FlakesCost)
-admin.site.register(PelletsPrice)
\ No newline at end of file
+admin.site.register(PelletsPrice)
+admin.site.register(BalanceCheckpoint)
\ No newline at end of file
@@ -4,7 +4,7 @@ from django.urls import converters
 
 
 class DecimalConverter:
-    regex = r'-?\d+\.?\d+'
+    regex = r'-?\d+(?:\.\d+)?'
 
     def to_python(self, value):
         return Decimal(value)
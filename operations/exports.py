@@ -0,0 +1,77 @@
+import csv
+import datetime
+import json
+import zlib
+from decimal import Decimal
+
+from django.http import StreamingHttpResponse
+
+FLUSH_SIZE = 64 * 1024
+
+
+class Echo:
+    # File-like object whose write() hands the line back, so csv.writer can feed a generator
+    def write(self, value):
+        return value
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(header, rows):
+    for row in rows:
+        yield json.dumps({name: _json_value(value) for name, value in zip(header, row)}) + '\n'
+
+
+def buffered(lines):
+    # Group lines into ~64KB blocks so the response isn't written one row at a time
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield ''.join(block).encode()
+            block, size = [], 0
+    if block:
+        yield ''.join(block).encode()
+
+
+def gzipped(blocks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_export(filename, file_format, header, rows, compress=False):
+    """
+    Stream ``rows`` (an iterator of tuples matching ``header``) as CSV or
+    NDJSON, optionally gzip-compressed, without holding the export in memory.
+    """
+    if file_format == 'ndjson':
+        lines, content_type, extension = ndjson_lines(header, rows), 'application/x-ndjson', 'ndjson'
+    else:
+        lines, content_type, extension = csv_lines(header, rows), 'text/csv', 'csv'
+
+    blocks = buffered(lines)
+    filename = f'{filename}.{extension}'
+    if compress:
+        blocks, content_type, filename = gzipped(blocks), 'application/gzip', f'{filename}.gz'
+
+    response = StreamingHttpResponse(blocks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,52 @@
+from django import forms
+
+from .models import RecyclingOperation
+
+
+class BalanceAsOfForm(forms.Form):
+    date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+
+
+class DateRangeForm(forms.Form):
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+
+class ElectricityFilterForm(forms.Form):
+    date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    shift = forms.TypedChoiceField(choices=[('', 'Any shift'), (1, 'Morning'), (2, 'Night')], coerce=int,
+                                   empty_value=None, required=False)
+    meter_ID = forms.CharField(required=False, max_length=100)
+
+
+class SalaryDisbursementForm(forms.Form):
+    description = forms.CharField(widget=forms.Textarea(attrs={'rows': 2}), initial="Salary payment")
+
+
+class PelletsReportForm(forms.Form):
+    year = forms.IntegerField(min_value=2000, max_value=2100)
+    flakes_type = forms.CharField(required=False, max_length=255)
+
+
+class LedgerImportForm(forms.Form):
+    file = forms.FileField(
+        help_text="CSV with amount, transaction_type, description and optional date columns, or JSON Lines"
+    )
+    file_format = forms.ChoiceField(choices=[('csv', 'CSV'), ('jsonl', 'JSON Lines')])
+    dry_run = forms.BooleanField(required=False, help_text="Only validate the file")
+
+
+class ExportForm(forms.Form):
+    file_format = forms.ChoiceField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], required=False)
+    compress = forms.BooleanField(required=False, help_text="gzip the export")
+
+
+class LedgerExportForm(DateRangeForm, ExportForm):
+    pass
+
+
+RecyclingOperationFormSet = forms.modelformset_factory(
+    RecyclingOperation,
+    fields=['meter_ID', 'customer_serial', 'material_used', 'bangori', 'rate', 'manager', 'operator', 'packer'],
+    extra=12,
+)
@@ -0,0 +1,164 @@
+import csv
+import datetime
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import BalanceCheckpoint, GeneralExpensesAccount, Transaction
+
+TRANSACTION_TYPES = {choice for choice, _ in Transaction.TRANSACTION_TYPE_CHOICES}
+
+
+class LedgerImportError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid ledger rows")
+
+
+def read_ledger_rows(stream, file_format):
+    """
+    Yield (line_number, row) pairs from a CSV (with an amount, transaction_type,
+    description and optional date header) or JSON Lines text stream without
+    loading it whole.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_number, None
+    else:
+        raise ValueError(f"Unsupported ledger format: {file_format}")
+
+
+def clean_posting_date(value):
+    # An ISO date or timestamp; a date alone posts at the start of that day, and no date posts now
+    value = str(value or '').strip()
+    if not value:
+        return None
+    try:
+        created_at = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError("date must be an ISO date or timestamp")
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at)
+    if created_at > timezone.now():
+        raise ValueError("date is in the future")
+    return created_at
+
+
+def clean_ledger_row(row):
+    # Returns (amount, transaction_type, description, created_at) or raises ValueError with the reason
+    if not isinstance(row, dict):
+        raise ValueError("not a JSON object")
+    try:
+        amount = Decimal(str(row.get('amount', '')).strip())
+    except InvalidOperation:
+        raise ValueError("amount is not a number")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError("amount must be positive")
+    if amount != amount.quantize(Decimal('0.01')) or amount >= Decimal('1e8'):
+        raise ValueError("amount must fit 10 digits with 2 decimal places")
+
+    transaction_type = str(row.get('transaction_type', '')).strip().lower()
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError("transaction_type must be credit or debit")
+
+    description = str(row.get('description') or '').strip()
+    return amount, transaction_type, description, clean_posting_date(row.get('date'))
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _net(chunk):
+    return sum((amount if transaction_type == 'credit' else -amount for amount, transaction_type, *_ in chunk),
+               Decimal('0.00'))
+
+
+def validate_ledger(rows, chunk_size, opening_balance):
+    """
+    Dry-run pass: check every row and that the balance stays non-negative at
+    each batch boundary. Returns (row_count, batch_count, closing_balance).
+    """
+    errors = []
+    balance = opening_balance
+    row_count = batch_count = 0
+
+    def cleaned():
+        for line_number, row in rows:
+            try:
+                yield clean_ledger_row(row)
+            except ValueError as exc:
+                errors.append(f"Line {line_number}: {exc}")
+
+    for chunk in _chunks(cleaned(), chunk_size):
+        row_count += len(chunk)
+        batch_count += 1
+        balance += _net(chunk)
+        if balance < 0 and not errors:
+            errors.append(f"Batch {batch_count} would take the balance below zero ({balance})")
+
+    if errors:
+        raise LedgerImportError(errors)
+    return row_count, batch_count, balance
+
+
+def import_ledger(rows, chunk_size=1000, account=None):
+    """
+    Insert validated ledger rows with one bulk_create and one balance UPDATE per
+    batch, all in one database transaction holding the account lock, so a
+    failure part way through (a bad row, or the balance having moved since
+    validate_ledger ran) leaves nothing imported. Checkpoints are rebuilt
+    when any row is dated before the ledger's latest entry.
+    """
+    imported = 0
+    cleaned = (clean_ledger_row(row) for _, row in rows)
+
+    with transaction.atomic():
+        accounts = GeneralExpensesAccount.objects.select_for_update()
+        locked = accounts.get(pk=account.pk) if account else accounts.order_by('pk').first()
+        latest = (Transaction.objects.filter(account=locked).order_by('-created_at', '-id')
+                  .values_list('created_at', flat=True).first())
+        balance = locked.balance
+        back_dated = False
+
+        for batch, chunk in enumerate(_chunks(cleaned, chunk_size), start=1):
+            balance += _net(chunk)
+            if balance < 0:
+                raise LedgerImportError([f"Batch {batch} would take the balance below zero ({balance})"])
+
+            now = timezone.now()
+            entries = []
+            for amount, transaction_type, description, created_at in chunk:
+                created_at = created_at or now
+                back_dated = back_dated or (latest is not None and created_at < latest)
+                latest = max(latest, created_at) if latest else created_at
+                entries.append(Transaction(account=locked, amount=amount, description=description,
+                                           transaction_type=transaction_type, created_at=created_at))
+            entries = Transaction.objects.bulk_create(entries)
+            GeneralExpensesAccount.objects.filter(pk=locked.pk).update(
+                balance=models.F('balance') + _net(chunk)
+            )
+            if not back_dated and entries[-1].pk is not None:
+                BalanceCheckpoint.after_posting(entries[-1])
+            imported += len(chunk)
+
+        if back_dated:
+            BalanceCheckpoint.rebuild(locked)
+
+    return imported
@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from operations.services import OverlappingPayrollPeriod, close_payroll_period
+
+
+class Command(BaseCommand):
+    help = "Write payroll statements for a period from its recycling operations and true up salary accruals"
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=datetime.date.fromisoformat, help="First day of the period (YYYY-MM-DD)")
+        parser.add_argument('end', type=datetime.date.fromisoformat, help="Last day of the period (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        if options['start'] > options['end']:
+            raise CommandError("start must not be after end")
+        try:
+            period, statements = close_payroll_period(options['start'], options['end'])
+        except OverlappingPayrollPeriod as exc:
+            raise CommandError(str(exc))
+        total = sum((statement.earnings for statement in statements), 0)
+        self.stdout.write(self.style.SUCCESS(f"{period}: {len(statements)} statements, N{total} earned"))
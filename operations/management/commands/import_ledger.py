@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from operations.importers import LedgerImportError, import_ledger, read_ledger_rows, validate_ledger
+from operations.models import GeneralExpensesAccount
+
+
+class Command(BaseCommand):
+    help = "Import bank statement or cashbook entries from a CSV or JSON Lines file into the expense ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="File format; guessed from the extension when omitted")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Validate the file without importing it")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or ('jsonl' if path.suffix in ('.jsonl', '.ndjson') else 'csv')
+        account = GeneralExpensesAccount.objects.order_by('pk').first()
+        if account is None:
+            raise CommandError("No GeneralExpensesAccount exists")
+
+        with path.open(newline='', encoding='utf-8') as stream:
+            try:
+                rows, batches, closing_balance = validate_ledger(
+                    read_ledger_rows(stream, file_format), options['chunk_size'], account.balance
+                )
+            except LedgerImportError as exc:
+                raise CommandError("\n".join(exc.errors))
+
+        self.stdout.write(f"{rows} rows in {batches} batches are valid; closing balance {closing_balance}")
+        if options['dry_run']:
+            return
+
+        with path.open(newline='', encoding='utf-8') as stream:
+            try:
+                imported = import_ledger(read_ledger_rows(stream, file_format), options['chunk_size'], account)
+            except LedgerImportError as exc:
+                raise CommandError("Nothing was imported:\n" + "\n".join(exc.errors))
+            except IntegrityError as exc:
+                raise CommandError(f"Nothing was imported: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} transactions"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from operations.models import BalanceCheckpoint, GeneralExpensesAccount
+
+
+class Command(BaseCommand):
+    help = "Recreate the balance checkpoints of every account from its transactions"
+
+    def handle(self, *args, **options):
+        for account in GeneralExpensesAccount.objects.all():
+            with transaction.atomic():
+                created = BalanceCheckpoint.rebuild(account)
+            self.stdout.write(f"{account}: {created} checkpoints")
@@ -0,0 +1,45 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
+
+from operations.models import CustomerIn, CustomerInRollup
+
+
+class Command(BaseCommand):
+    help = "Recompute every CustomerIn processing rollup from its recycling operations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=14, decimal_places=2))
+        totals = CustomerIn.objects.filter(recyclingoperation__isnull=False).annotate(
+            total_material_used=Coalesce(Sum('recyclingoperation__material_used'), zero),
+            total_bangori=Coalesce(Sum('recyclingoperation__bangori'), zero),
+            total_amount=Coalesce(Sum('recyclingoperation__amount'), zero),
+            total_operations=Count('recyclingoperation'),
+        ).values_list('pk', 'material_quantity', 'total_material_used', 'total_bangori', 'total_amount',
+                      'total_operations').order_by('pk')
+
+        created = 0
+        with transaction.atomic():
+            CustomerInRollup.objects.all().delete()
+            batch = []
+            for pk, quantity, material_used, bangori, amount, operation_count in totals.iterator(
+                    chunk_size=options['chunk_size']):
+                batch.append(CustomerInRollup(
+                    customer_in_id=pk, material_used=material_used, bangori=bangori,
+                    material_lost=quantity - material_used - bangori, amount=amount,
+                    operation_count=operation_count,
+                ))
+                if len(batch) >= options['chunk_size']:
+                    CustomerInRollup.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            CustomerInRollup.objects.bulk_create(batch)
+            created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} rollups"))
@@ -0,0 +1,51 @@
+import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from operations.models import Electricity, ElectricityTariff
+from operations.services import refresh_electricity_variance
+
+
+class Command(BaseCommand):
+    help = "Recompute electricity_cost from the tariff in force on each reading's date"
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=datetime.date.fromisoformat, help="First date to reprice (YYYY-MM-DD)")
+        parser.add_argument('end', type=datetime.date.fromisoformat, help="Last date to reprice (YYYY-MM-DD)")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        readings = Electricity.objects.filter(
+            date__range=(options['start'], options['end']), electricity_consumption__isnull=False,
+        ).only('date', 'electricity_consumption', 'electricity_cost').order_by('pk')
+
+        repriced = 0
+        last_pk = 0
+        while True:
+            chunk = list(readings.filter(pk__gt=last_pk)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            # One schedule lookup per chunk, bisected locally for each reading
+            schedule = ElectricityTariff.schedule()
+            default = ElectricityTariff.default_cost_per_unit()
+            changed = []
+            for reading in chunk:
+                cost_per_unit = ElectricityTariff.cost_in_schedule(schedule, reading.date, default)
+                if cost_per_unit is None:
+                    continue
+                cost = (reading.electricity_consumption * cost_per_unit).quantize(Decimal('0.01'))
+                if cost != reading.electricity_cost:
+                    reading.electricity_cost = cost
+                    changed.append(reading)
+
+            if changed:
+                with transaction.atomic():
+                    Electricity.objects.bulk_update(changed, ['electricity_cost'])
+                    refresh_electricity_variance(changed)
+            repriced += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"Repriced {repriced} readings"))
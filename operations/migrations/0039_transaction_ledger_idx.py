@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0038_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'created_at', 'id'], name='transaction_ledger_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0039_transaction_ledger_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='operations.generalexpensesaccount')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='operations.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'created_at', 'transaction'], name='checkpoint_lookup_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+def correct_negative_balances(apps, schema_editor):
+    # Earlier salary payments could overdraw the account; bring it back to zero with a posted credit so the
+    # ledger still explains the balance, then the constraint can go on
+    GeneralExpensesAccount = apps.get_model('operations', 'GeneralExpensesAccount')
+    Transaction = apps.get_model('operations', 'Transaction')
+    for account in GeneralExpensesAccount.objects.filter(balance__lt=0):
+        Transaction.objects.create(
+            account=account,
+            amount=-account.balance,
+            description="Correction: balance was negative before overdrafts were blocked",
+            transaction_type='credit',
+        )
+        account.balance = 0
+        account.save(update_fields=['balance'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0040_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(correct_negative_balances, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='generalexpensesaccount',
+            constraint=models.CheckConstraint(check=models.Q(('balance__gte', 0)), name='general_expenses_balance_non_negative'),
+        ),
+    ]
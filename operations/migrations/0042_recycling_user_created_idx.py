@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0041_general_expenses_balance_non_negative'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recyclingoperation',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='recycling_user_created_idx'),
+        ),
+    ]
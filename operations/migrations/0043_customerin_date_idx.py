@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0042_recycling_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerin',
+            index=models.Index(fields=['date', 'id'], name='customerin_date_idx'),
+        ),
+    ]
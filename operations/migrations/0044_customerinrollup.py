@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:23
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+
+
+def build_rollups(apps, schema_editor):
+    CustomerIn = apps.get_model('operations', 'CustomerIn')
+    CustomerInRollup = apps.get_model('operations', 'CustomerInRollup')
+    totals = CustomerIn.objects.filter(recyclingoperation__isnull=False).annotate(
+        total_material_used=Sum('recyclingoperation__material_used'),
+        total_bangori=Sum('recyclingoperation__bangori'),
+        total_amount=Sum('recyclingoperation__amount'),
+        total_operations=Count('recyclingoperation'),
+    )
+    CustomerInRollup.objects.bulk_create([
+        CustomerInRollup(
+            customer_in_id=intake.pk,
+            material_used=intake.total_material_used or 0,
+            bangori=intake.total_bangori or 0,
+            material_lost=intake.material_quantity - (intake.total_material_used or 0) - (intake.total_bangori or 0),
+            amount=intake.total_amount or 0,
+            operation_count=intake.total_operations,
+        )
+        for intake in totals.iterator()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0043_customerin_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerInRollup',
+            fields=[
+                ('customer_in', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='operations.customerin')),
+                ('material_used', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('bangori', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('material_lost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('operation_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0044_customerinrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='electricity',
+            index=models.Index(fields=['date', 'shift'], name='electricity_date_shift_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='electricity',
+            index=models.Index(fields=['meter_ID', 'date', 'shift'], name='electricity_meter_date_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0045_electricity_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterHead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('meter_ID', models.CharField(max_length=100, unique=True)),
+                ('latest', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='operations.electricity')),
+            ],
+        ),
+    ]
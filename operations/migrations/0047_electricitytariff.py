@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0046_meterhead'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElectricityTariff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('effective_from', models.DateField(unique=True)),
+                ('cost_per_unit', models.DecimalField(decimal_places=2, max_digits=5)),
+            ],
+            options={
+                'ordering': ['effective_from'],
+            },
+        ),
+    ]
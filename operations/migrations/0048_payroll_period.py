@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0047_electricitytariff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayrollPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateField()),
+                ('end', models.DateField()),
+                ('closed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PayrollStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('manager', 'Manager'), ('operator', 'Operator'), ('packer', 'Packer')], max_length=10)),
+                ('staff_id', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=100)),
+                ('material_used', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('operation_count', models.IntegerField()),
+                ('earnings', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='operations.payrollperiod')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='payrollperiod',
+            constraint=models.UniqueConstraint(fields=('start', 'end'), name='payroll_period_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='payrollperiod',
+            constraint=models.CheckConstraint(check=models.Q(('start__lte', models.F('end'))), name='payroll_period_ordered'),
+        ),
+        migrations.AddConstraint(
+            model_name='payrollstatement',
+            constraint=models.UniqueConstraint(fields=('period', 'role', 'staff_id'), name='payroll_statement_unique'),
+        ),
+    ]
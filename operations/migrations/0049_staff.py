@@ -0,0 +1,81 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:02
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0048_payroll_period'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Staff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('phone_number', models.CharField(max_length=15)),
+                ('address', models.TextField(blank=True, null=True)),
+                ('role', models.CharField(choices=[('manager', 'Manager'), ('operator', 'Operator'), ('packer', 'Packer')], max_length=10)),
+            ],
+            options={
+                'verbose_name_plural': 'staff',
+                'indexes': [models.Index(fields=['role', 'name'], name='staff_role_name_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Salary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount1', models.DecimalField(decimal_places=2, default=Decimal('0.0'), max_digits=10)),
+                ('staff', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='salary', to='operations.staff')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalaryPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount1', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('description', models.TextField()),
+                ('due_date', models.DateTimeField(auto_now_add=True)),
+                ('staff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='salary_payments', to='operations.staff')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['staff', 'due_date'], name='salarypayment_staff_idx')],
+            },
+        ),
+        # Filled in by 0050 from the per-role tables, then renamed over the old columns in 0051
+        migrations.AddField(
+            model_name='recyclingoperation',
+            name='manager_staff',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='operations.staff'),
+        ),
+        migrations.AddField(
+            model_name='recyclingoperation',
+            name='operator_staff',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='operations.staff'),
+        ),
+        migrations.AddField(
+            model_name='recyclingoperation',
+            name='packer_staff',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='operations.staff'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='payrollstatement',
+            name='payroll_statement_unique',
+        ),
+        migrations.RenameField(
+            model_name='payrollstatement',
+            old_name='staff_id',
+            new_name='legacy_staff_id',
+        ),
+        migrations.AddField(
+            model_name='payrollstatement',
+            name='staff',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payroll_statements', to='operations.staff'),
+        ),
+    ]
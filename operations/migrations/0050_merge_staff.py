@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:02
+
+from django.db import migrations
+from django.db.models import Sum
+
+ROLES = (
+    ('manager', 'Manager', 'SalaryManager', 'ManagerSalaryPayment'),
+    ('operator', 'Operator', 'SalaryOperator', 'OperatorSalaryPayment'),
+    ('packer', 'Packer', 'SalaryPacker', 'PackerSalaryPayment'),
+)
+
+
+def merge_staff(apps, schema_editor):
+    Staff = apps.get_model('operations', 'Staff')
+    Salary = apps.get_model('operations', 'Salary')
+    SalaryPayment = apps.get_model('operations', 'SalaryPayment')
+    RecyclingOperation = apps.get_model('operations', 'RecyclingOperation')
+    PayrollStatement = apps.get_model('operations', 'PayrollStatement')
+
+    for role, staff_model, salary_model, payment_model in ROLES:
+        people = list(apps.get_model('operations', staff_model).objects.order_by('pk'))
+        created = Staff.objects.bulk_create([
+            Staff(name=person.name, email=person.email, phone_number=person.phone_number, address=person.address,
+                  role=role)
+            for person in people
+        ])
+        staff_ids = {person.pk: staff.pk for person, staff in zip(people, created)}
+
+        for old_id, new_id in staff_ids.items():
+            RecyclingOperation.objects.filter(**{f'{role}_id': old_id}).update(**{f'{role}_staff_id': new_id})
+            PayrollStatement.objects.filter(role=role, legacy_staff_id=old_id).update(staff_id=new_id)
+
+        # The per-role accrual tables allowed several rows per person; they are summed into one
+        accruals = apps.get_model('operations', salary_model).objects.values(f'{role}_id').annotate(
+            total=Sum('amount1')).values_list(f'{role}_id', 'total')
+        Salary.objects.bulk_create([Salary(staff_id=staff_ids[old_id], amount1=total) for old_id, total in accruals])
+
+        old_payments = list(apps.get_model('operations', payment_model).objects.order_by('pk'))
+        payments = SalaryPayment.objects.bulk_create([
+            SalaryPayment(staff_id=staff_ids[getattr(payment, f'{role}_id')], amount1=payment.amount1,
+                          description=payment.description)
+            for payment in old_payments
+        ])
+        # auto_now_add stamped the inserts; put the original payment dates back
+        for payment, old_payment in zip(payments, old_payments):
+            payment.due_date = old_payment.due_date
+        SalaryPayment.objects.bulk_update(payments, ['due_date'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0049_staff'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_staff, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0050_merge_staff'),
+    ]
+
+    operations = [
+        migrations.RemoveField(model_name='recyclingoperation', name='manager'),
+        migrations.RemoveField(model_name='recyclingoperation', name='operator'),
+        migrations.RemoveField(model_name='recyclingoperation', name='packer'),
+        migrations.RenameField(model_name='recyclingoperation', old_name='manager_staff', new_name='manager'),
+        migrations.RenameField(model_name='recyclingoperation', old_name='operator_staff', new_name='operator'),
+        migrations.RenameField(model_name='recyclingoperation', old_name='packer_staff', new_name='packer'),
+        migrations.AlterField(
+            model_name='recyclingoperation',
+            name='manager',
+            field=models.ForeignKey(limit_choices_to={'role': 'manager'}, on_delete=django.db.models.deletion.CASCADE, related_name='managed_operations', to='operations.staff'),
+        ),
+        migrations.AlterField(
+            model_name='recyclingoperation',
+            name='operator',
+            field=models.ForeignKey(limit_choices_to={'role': 'operator'}, on_delete=django.db.models.deletion.CASCADE, related_name='operated_operations', to='operations.staff'),
+        ),
+        migrations.AlterField(
+            model_name='recyclingoperation',
+            name='packer',
+            field=models.ForeignKey(limit_choices_to={'role': 'packer'}, on_delete=django.db.models.deletion.CASCADE, related_name='packed_operations', to='operations.staff'),
+        ),
+        migrations.RemoveField(model_name='payrollstatement', name='legacy_staff_id'),
+        migrations.AlterField(
+            model_name='payrollstatement',
+            name='staff',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payroll_statements', to='operations.staff'),
+        ),
+        migrations.AddConstraint(
+            model_name='payrollstatement',
+            constraint=models.UniqueConstraint(fields=('period', 'staff'), name='payroll_statement_unique'),
+        ),
+        migrations.DeleteModel(name='SalaryManager'),
+        migrations.DeleteModel(name='SalaryOperator'),
+        migrations.DeleteModel(name='SalaryPacker'),
+        migrations.DeleteModel(name='ManagerSalaryPayment'),
+        migrations.DeleteModel(name='OperatorSalaryPayment'),
+        migrations.DeleteModel(name='PackerSalaryPayment'),
+        migrations.DeleteModel(name='Manager'),
+        migrations.DeleteModel(name='Operator'),
+        migrations.DeleteModel(name='Packer'),
+    ]
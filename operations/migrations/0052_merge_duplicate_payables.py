@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:40
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_payables(apps, schema_editor):
+    # Fold every customer's payable rows into their oldest row before the unique constraint goes on
+    AccountPayable = apps.get_model('operations', 'AccountPayable')
+    duplicates = AccountPayable.objects.values('customer').annotate(
+        rows=Count('pk'), keep=Min('pk'), total=Sum('amount')).filter(rows__gt=1)
+    for duplicate in list(duplicates):
+        AccountPayable.objects.filter(pk=duplicate['keep']).update(amount=duplicate['total'])
+        AccountPayable.objects.filter(customer=duplicate['customer']).exclude(pk=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0051_remove_per_role_staff'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_payables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0052_merge_duplicate_payables'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='accountpayable',
+            constraint=models.UniqueConstraint(fields=('customer',), name='accountpayable_customer_unique'),
+        ),
+    ]
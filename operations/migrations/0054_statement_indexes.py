@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0053_accountpayable_customer_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['customer', 'due_date', 'id'], name='payment_customer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recyclingoperation',
+            index=models.Index(fields=['customer_serial', 'created_at', 'id'], name='recycling_intake_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0054_statement_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pelletsprice',
+            index=models.Index(fields=['date'], name='pelletsprice_date_idx'),
+        ),
+    ]
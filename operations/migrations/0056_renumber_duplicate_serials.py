@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def renumber_duplicate_serials(apps, schema_editor):
+    # Keep each serial on its oldest row and move later duplicates onto fresh serials before the unique indexes go on
+    CustomerIn = apps.get_model('operations', 'CustomerIn')
+    duplicates = CustomerIn.objects.values('customer_serial').annotate(rows=Count('pk')).filter(rows__gt=1)
+    next_serial = (CustomerIn.objects.aggregate(top=Max('customer_serial'))['top'] or 0) // 1 + 1
+    for duplicate in list(duplicates):
+        for customer_in in CustomerIn.objects.filter(customer_serial=duplicate['customer_serial']).order_by('pk')[1:]:
+            customer_in.customer_serial = next_serial
+            customer_in.save(update_fields=['customer_serial'])
+            next_serial += 1
+
+    FlakesIn = apps.get_model('operations', 'FlakesIn')
+    duplicates = FlakesIn.objects.values('serial').annotate(rows=Count('pk')).filter(rows__gt=1)
+    for duplicate in list(duplicates):
+        for flakes_in in FlakesIn.objects.filter(serial=duplicate['serial']).order_by('pk')[1:]:
+            flakes_in.serial = f"{flakes_in.serial}-{flakes_in.pk}"[-100:]
+            flakes_in.save(update_fields=['serial'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0055_pelletsprice_date_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_serials, migrations.RunPython.noop),
+    ]
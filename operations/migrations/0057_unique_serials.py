@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0056_renumber_duplicate_serials'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customerin',
+            name='customer_serial',
+            field=models.DecimalField(decimal_places=2, max_digits=10, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='flakesin',
+            name='serial',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:05
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def renumber_fractional_serials(apps, schema_editor):
+    # Whole-number serials survive the move to an integer column; fractional ones get fresh serials above the maximum
+    CustomerIn = apps.get_model('operations', 'CustomerIn')
+    top = CustomerIn.objects.aggregate(top=Max('customer_serial'))['top'] or 0
+    next_serial = int(top) + 1
+    for customer_in in CustomerIn.objects.order_by('pk'):
+        if customer_in.customer_serial != int(customer_in.customer_serial):
+            customer_in.customer_serial = next_serial
+            customer_in.save(update_fields=['customer_serial'])
+            next_serial += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0057_unique_serials'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerialSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(renumber_fractional_serials, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customerin',
+            name='customer_serial',
+            field=models.PositiveIntegerField(unique=True),
+        ),
+    ]
@@ -1,9 +1,16 @@
+import bisect
+import datetime
+
 from _decimal import Decimal
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .pagination import keyset_filter
+from .singletons import CachedSingletonMixin, get_cached
 
 
 class ExpenseCategory(models.Model):
@@ -36,21 +43,78 @@ class GeneralExpensesAccount(models.Model):
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
     def credit(self, amount, description=""):
-        self.balance += amount
-        self.description = description
-        self.save()
+        # Applied as an UPDATE ... SET balance = balance + amount so concurrent postings don't overwrite each other
+        GeneralExpensesAccount.objects.filter(pk=self.pk).update(balance=models.F('balance') + amount)
+        self.refresh_from_db(fields=['balance'])
 
     def debit(self, amount, description=""):
-        if self.balance >= amount:
-            self.balance -= amount
-            self.description = description  # Set the description for the debit
-            self.save()
-        else:
+        # The balance check and the decrement happen in the same statement
+        updated = GeneralExpensesAccount.objects.filter(pk=self.pk, balance__gte=amount).update(
+            balance=models.F('balance') - amount
+        )
+        if not updated:
             raise ValueError("Insufficient balance")
+        self.refresh_from_db(fields=['balance'])
+
+    def balance_before(self, created_at, pk=0):
+        """
+        Balance from every transaction posted strictly before (created_at, pk),
+        read from the nearest checkpoint plus the short tail of postings after it.
+        """
+        key = ('created_at', 'transaction_id')
+        checkpoint = (BalanceCheckpoint.objects.filter(account=self)
+                      .filter(keyset_filter(key, (created_at, pk), descending=True))
+                      .order_by('-created_at', '-transaction_id').first())
+
+        tail = Transaction.objects.filter(account=self).filter(
+            keyset_filter(('created_at', 'id'), (created_at, pk), descending=True)
+        )
+        opening_balance = Decimal('0.00')
+        if checkpoint:
+            opening_balance = checkpoint.balance
+            tail = tail.filter(keyset_filter(('created_at', 'id'), (checkpoint.created_at, checkpoint.transaction_id)))
+
+        return opening_balance + (tail.aggregate(total=models.Sum(signed_amount()))['total'] or Decimal('0.00'))
+
+    def balance_as_of(self, date):
+        # Closing balance at the end of ``date``
+        next_day = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time.min)
+        return self.balance_before(timezone.make_aware(next_day))
 
     def __str__(self):
         return self.account_name
 
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(balance__gte=0), name='general_expenses_balance_non_negative'),
+        ]
+
+
+def signed_amount():
+    # Credits add to the balance, debits take from it
+    return models.Case(
+        models.When(transaction_type='debit', then=-models.F('amount')),
+        default=models.F('amount'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+class TransactionQuerySet(models.QuerySet):
+    def with_running_balance(self):
+        """
+        Annotate each row with the cumulative signed amount in ledger order.
+        The sum starts at the first row matched by the query, so callers
+        paging through the ledger add the balance brought forward.
+        """
+        return self.annotate(
+            running_balance=models.Window(
+                expression=models.Sum(signed_amount()),
+                partition_by=[models.F('account')],
+                order_by=[models.F('created_at').asc(), models.F('id').asc()],
+                frame=models.RowRange(start=None, end=0),
+            )
+        )
+
 
 class Transaction(models.Model):
     TRANSACTION_TYPE_CHOICES = [
@@ -63,28 +127,85 @@ class Transaction(models.Model):
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     description = models.TextField()
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPE_CHOICES)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set explicitly by the ledger import for back-dated entries
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = TransactionQuerySet.as_manager()
 
     def __str__(self):
         return f"Transaction for {self.account.account_name}"
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['account', 'created_at', 'id'], name='transaction_ledger_idx'),
+        ]
 
 
-class Customer(models.Model):
-    name = models.CharField(max_length=100)
-    email = models.EmailField(blank=True, null=True)
-    phone_number = models.CharField(max_length=15)
-    address = models.TextField(blank=True, null=True)
+class BalanceCheckpoint(models.Model):
+    """
+    Balance of an account after ``transaction``, snapshotted every
+    ``INTERVAL`` postings so past balances never replay the whole ledger.
+    """
+    INTERVAL = 100
 
-    # Add any other fields specific to your Customer model.
+    account = models.ForeignKey(GeneralExpensesAccount, on_delete=models.CASCADE)
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
 
     def __str__(self):
-        return self.name
+        return f"Checkpoint for {self.account.account_name} at {self.created_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'created_at', 'transaction'], name='checkpoint_lookup_idx'),
+        ]
+
+    @classmethod
+    def after_posting(cls, transaction):
+        # Called once a transaction is saved; writes a checkpoint when the uncovered tail reaches INTERVAL
+        account = transaction.account
+        key = (transaction.created_at, transaction.pk)
+        last = cls.objects.filter(account=account).order_by('-created_at', '-transaction_id').first()
+
+        tail = Transaction.objects.filter(account=account).filter(
+            keyset_filter(('created_at', 'id'), key, descending=True, inclusive=True)
+        )
+        opening_balance = Decimal('0.00')
+        if last:
+            opening_balance = last.balance
+            tail = tail.filter(keyset_filter(('created_at', 'id'), (last.created_at, last.transaction_id)))
+
+        totals = tail.aggregate(count=models.Count('id'), total=models.Sum(signed_amount()))
+        if totals['count'] >= cls.INTERVAL:
+            return cls.objects.create(
+                account=account,
+                transaction=transaction,
+                created_at=transaction.created_at,
+                balance=opening_balance + totals['total'],
+            )
+        return None
+
+    @classmethod
+    def rebuild(cls, account):
+        """
+        Recreate every checkpoint for ``account`` in one pass over the ledger,
+        for use after transactions were edited or deleted out of band.
+        """
+        cls.objects.filter(account=account).delete()
+        checkpoints = []
+        ledger = (Transaction.objects.filter(account=account).with_running_balance()
+                  .order_by('created_at', 'id').values_list('id', 'created_at', 'running_balance'))
+        for position, (pk, created_at, running_balance) in enumerate(ledger.iterator(), start=1):
+            if position % cls.INTERVAL == 0:
+                checkpoints.append(cls(account=account, transaction_id=pk, created_at=created_at,
+                                       balance=running_balance))
+        cls.objects.bulk_create(checkpoints)
+        return len(checkpoints)
 
 
-class Packer(models.Model):
+class Customer(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField(blank=True, null=True)
     phone_number = models.CharField(max_length=15)
@@ -96,36 +217,74 @@ class Packer(models.Model):
         return self.name
 
 
-class Operator(models.Model):
-    name = models.CharField(max_length=100)
-    email = models.EmailField(blank=True, null=True)
-    phone_number = models.CharField(max_length=15)
-    address = models.TextField(blank=True, null=True)
-
-    # Add any other fields specific to your Customer model.
-
-    def __str__(self):
-        return self.name
+STAFF_ROLES = (('manager', 'Manager'), ('operator', 'Operator'), ('packer', 'Packer'))
 
 
-class Manager(models.Model):
+class Staff(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField(blank=True, null=True)
     phone_number = models.CharField(max_length=15)
     address = models.TextField(blank=True, null=True)
+    role = models.CharField(max_length=10, choices=STAFF_ROLES)
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        verbose_name_plural = 'staff'
+        indexes = [
+            models.Index(fields=['role', 'name'], name='staff_role_name_idx'),
+        ]
 
-class ElectricityConfiguration(models.Model):
+
+class ElectricityConfiguration(CachedSingletonMixin, models.Model):
     fixed_cost_per_unit = models.DecimalField(max_digits=5, decimal_places=2)
 
     def __str__(self):
         return f"Electricity Configuration - N{self.fixed_cost_per_unit} per unit"
 
 
-class InitialMeterReading(models.Model):
+class ElectricityTariff(models.Model):
+    """
+    Cost per unit of electricity from ``effective_from`` until the next
+    tariff starts. Dates before the first tariff use ElectricityConfiguration, if set.
+    """
+    effective_from = models.DateField(unique=True)
+    cost_per_unit = models.DecimalField(max_digits=5, decimal_places=2)
+
+    def __str__(self):
+        return f"N{self.cost_per_unit} per unit from {self.effective_from}"
+
+    @classmethod
+    def schedule(cls):
+        # (start dates, costs) in date order, shared through the singleton cache
+        return get_cached(cls, 'schedule', lambda: tuple(
+            zip(*cls.objects.order_by('effective_from').values_list('effective_from', 'cost_per_unit'))
+        ) or ((), ()))
+
+    @classmethod
+    def default_cost_per_unit(cls):
+        # For dates before the first tariff
+        configuration = ElectricityConfiguration.cached()
+        return configuration.fixed_cost_per_unit if configuration else None
+
+    @staticmethod
+    def cost_in_schedule(schedule, date, default=None):
+        # Cost on ``date`` from a schedule() already in hand, so callers pricing many readings load it once
+        starts, costs = schedule
+        index = bisect.bisect_right(starts, date)
+        return costs[index - 1] if index else default
+
+    @classmethod
+    def cost_per_unit_on(cls, date):
+        cost = cls.cost_in_schedule(cls.schedule(), date)
+        return cost if cost is not None else cls.default_cost_per_unit()
+
+    class Meta:
+        ordering = ['effective_from']
+
+
+class InitialMeterReading(CachedSingletonMixin, models.Model):
     initial_reading = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
 
     def __str__(self):
@@ -138,7 +297,7 @@ def validate_no_numbers(value):
 
 
 class CustomerIn(models.Model):
-    customer_serial = models.DecimalField(max_digits=10, decimal_places=2)
+    customer_serial = models.PositiveIntegerField(unique=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     material_type = models.CharField(max_length=255, validators=[validate_no_numbers])
     material_quantity = models.DecimalField(max_digits=10, decimal_places=2)
@@ -148,6 +307,11 @@ class CustomerIn(models.Model):
     def __str__(self):
         return str(self.customer_serial)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'id'], name='customerin_date_idx'),
+        ]
+
 
 class Electricity(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -168,6 +332,36 @@ class Electricity(models.Model):
     def __str__(self):
         return str(self.meter_ID)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'shift'], name='electricity_date_shift_idx'),
+            models.Index(fields=['meter_ID', 'date', 'shift'], name='electricity_meter_date_idx'),
+        ]
+
+
+class SerialSequence(models.Model):
+    """
+    Next unreserved value of a named serial number sequence. Workers take
+    blocks of values from it under the row lock and hand them out locally.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class MeterHead(models.Model):
+    """
+    The latest reading captured on each meter. Readings for a meter are
+    taken while holding this row's lock, so concurrent captures chain correctly.
+    """
+    meter_ID = models.CharField(max_length=100, unique=True)
+    latest = models.ForeignKey(Electricity, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    def __str__(self):
+        return str(self.meter_ID)
+
 
 class RecyclingOperation(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -179,15 +373,58 @@ class RecyclingOperation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     standard_electricity_cost = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     electricity_variance = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
-    manager = models.ForeignKey(Manager, on_delete=models.CASCADE)
-    operator = models.ForeignKey(Operator, on_delete=models.CASCADE)
-    packer = models.ForeignKey(Packer, on_delete=models.CASCADE)
+    manager = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='managed_operations',
+                                limit_choices_to={'role': 'manager'})
+    operator = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='operated_operations',
+                                 limit_choices_to={'role': 'operator'})
+    packer = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='packed_operations',
+                               limit_choices_to={'role': 'packer'})
     amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     amount1 = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
 
+    def calculate_fields(self):
+        self.standard_electricity_cost = (self.material_used * self.rate) / Decimal('2.37')
+        self.amount = self.rate * self.material_used
+
+        electricity_instance = self.meter_ID
+        if electricity_instance:
+            electricity_cost = electricity_instance.electricity_cost or Decimal('0.00')
+            standard_electricity_cost = self.standard_electricity_cost or Decimal('0.00')
+            self.electricity_variance = standard_electricity_cost - electricity_cost
+        else:
+            self.electricity_variance = None
+
     def __str__(self):
         return f"Recycling Operation - CustomerIn: {str(self.customer_serial)}, Date: {self.meter_ID.date}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='recycling_user_created_idx'),
+            models.Index(fields=['customer_serial', 'created_at', 'id'], name='recycling_intake_created_idx'),
+        ]
+
+
+class CustomerInRollup(models.Model):
+    """
+    Running totals of the recycling operations posted against one intake,
+    maintained in the same transaction as every operation insert, edit and delete.
+
+    It follows model save() and delete() (queryset delete() too, which sends
+    the delete signal per row) and post_recycling_operations. Queryset
+    update(), bulk_update(), raw SQL and data migrations that change
+    operations or intake quantities skip the signals, so run
+    ``manage.py rebuild_customerin_rollups`` after them.
+    """
+    customer_in = models.OneToOneField(CustomerIn, on_delete=models.CASCADE, primary_key=True, related_name='rollup')
+    material_used = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    bangori = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    material_lost = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    operation_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Rollup for {self.customer_in_id}"
+
 
 class Payment(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
@@ -195,72 +432,98 @@ class Payment(models.Model):
     description = models.TextField()
     due_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'due_date', 'id'], name='payment_customer_date_idx'),
+        ]
+
 
 class AccountPayable(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     due_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer'], name='accountpayable_customer_unique'),
+        ]
+
 
-class SalaryManager(models.Model):
-    manager = models.ForeignKey(Manager, on_delete=models.CASCADE)
+class Salary(models.Model):
+    """Salary a staff member has earned and not yet been paid."""
+    staff = models.OneToOneField(Staff, on_delete=models.CASCADE, related_name='salary')
     amount1 = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.0'))
 
     def __str__(self):
-        return "Salary Manager"
+        return f"Salary {self.staff}"
 
     def nil_accounts(self):
-        self.manager = 0
-        self.save()
+        self.amount1 = Decimal('0.0')
+        self.save(update_fields=['amount1'])
 
 
-class SalaryOperator(models.Model):
-    operator = models.ForeignKey(Operator, on_delete=models.CASCADE)
-    amount1 = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.0'))
-
-    def __str__(self):
-        return "Salary Operator"
+class SalaryPayment(models.Model):
+    staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='salary_payments')
+    amount1 = models.DecimalField(max_digits=10, decimal_places=2)
+    description = models.TextField()
+    due_date = models.DateTimeField(auto_now_add=True)
 
-    def nil_accounts(self):
-        self.operator = 0
-        self.save()
+    class Meta:
+        indexes = [
+            models.Index(fields=['staff', 'due_date'], name='salarypayment_staff_idx'),
+        ]
 
 
-class SalaryPacker(models.Model):
-    packer = models.ForeignKey(Packer, on_delete=models.CASCADE)
-    amount1 = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.0'))
+class PayrollPeriod(models.Model):
+    start = models.DateField()
+    end = models.DateField()
+    closed_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return "Salary Packer"
-
-    def nil_accounts(self):
-        self.packer = 0
-        self.save()
+        return f"Payroll {self.start} to {self.end}"
 
+    def clean(self):
+        # Overlapping periods would pay the operations they share twice
+        if self.start and self.end and PayrollPeriod.objects.filter(
+                start__lte=self.end, end__gte=self.start).exclude(pk=self.pk).exists():
+            raise ValidationError("This period overlaps a payroll period that is already closed.")
 
-class ManagerSalaryPayment(models.Model):
-    manager = models.ForeignKey(Manager, on_delete=models.CASCADE)
-    amount1 = models.DecimalField(max_digits=10, decimal_places=2)
-    description = models.TextField()
-    due_date = models.DateTimeField(auto_now_add=True)
-
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['start', 'end'], name='payroll_period_unique'),
+            models.CheckConstraint(check=models.Q(start__lte=models.F('end')), name='payroll_period_ordered'),
+        ]
+
+
+class PayrollStatement(models.Model):
+    """
+    One staff member's earnings for a closed payroll period. Statements are
+    never edited: closing the period again replaces them as a whole.
+    """
+    period = models.ForeignKey(PayrollPeriod, on_delete=models.CASCADE, related_name='statements')
+    staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='payroll_statements')
+    role = models.CharField(max_length=10, choices=STAFF_ROLES)
+    name = models.CharField(max_length=100)
+    material_used = models.DecimalField(max_digits=12, decimal_places=2)
+    operation_count = models.IntegerField()
+    earnings = models.DecimalField(max_digits=12, decimal_places=2)
 
-class OperatorSalaryPayment(models.Model):
-    operator = models.ForeignKey(Operator, on_delete=models.CASCADE)
-    amount1 = models.DecimalField(max_digits=10, decimal_places=2)
-    description = models.TextField()
-    due_date = models.DateTimeField(auto_now_add=True)
+    def __str__(self):
+        return f"{self.name} ({self.role}): N{self.earnings}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Payroll statements can't be changed; close the period again instead")
+        super().save(*args, **kwargs)
 
-class PackerSalaryPayment(models.Model):
-    packer = models.ForeignKey(Packer, on_delete=models.CASCADE)
-    amount1 = models.DecimalField(max_digits=10, decimal_places=2)
-    description = models.TextField()
-    due_date = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'staff'], name='payroll_statement_unique'),
+        ]
 
 
 class FlakesIn(models.Model):
-    serial = models.CharField(max_length=100)
+    serial = models.CharField(max_length=100, unique=True)
     date = models.DateField()
     flakes_type = models.CharField(max_length=255, validators=[validate_no_numbers])
     flakes_quantity = models.DecimalField(max_digits=10, decimal_places=2)
@@ -293,4 +556,9 @@ class PelletsPrice(models.Model):
     profit = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
 
     def __str__(self):
-        return 'Pellet Price'
\ No newline at end of file
+        return 'Pellet Price'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date'], name='pelletsprice_date_idx'),
+        ]
\ No newline at end of file
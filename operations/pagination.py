@@ -0,0 +1,113 @@
+import base64
+
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    raw = '|'.join(value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(model, fields, cursor):
+    # fields are model field names, or Field instances when model is None (e.g. for a UNION)
+    # Returns None for a missing or tampered cursor so the view falls back to the first page
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    parts = raw.split('|')
+    if len(parts) != len(fields):
+        return None
+    if model is not None:
+        fields = [model._meta.get_field(name) for name in fields]
+    try:
+        return [field.to_python(part) for field, part in zip(fields, parts)]
+    except Exception:
+        return None
+
+
+def keyset_filter(fields, values, descending=False, inclusive=False):
+    """
+    Build the row-value comparison (f1, f2, ...) > (v1, v2, ...) as a Q object,
+    which the database can answer with a range scan on a matching composite index.
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for position in reversed(range(len(fields))):
+        step = Q(**{f'{fields[position]}__{lookup}': values[position]})
+        if position == len(fields) - 1 and inclusive:
+            step |= Q(**{fields[position]: values[position]})
+        elif position < len(fields) - 1:
+            step |= Q(**{fields[position]: values[position]}) & condition
+        condition = step
+    return condition
+
+
+class KeysetPage:
+    """
+    A page of rows fetched with a cursor instead of an OFFSET, so deep pages
+    cost the same as the first one.
+    """
+
+    def __init__(self, object_list, fields, has_next, has_previous):
+        self.object_list = object_list
+        self.fields = fields
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _cursor(self, obj):
+        return encode_cursor([getattr(obj, name) for name in self.fields])
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self._cursor(self.object_list[0])
+        return None
+
+
+def paginate_keyset(queryset, fields, per_page, after=None, before=None, descending=False):
+    """
+    Return a KeysetPage of ``queryset`` ordered by ``fields``.
+
+    ``after`` and ``before`` are cursors taken from a previous page's
+    ``next_cursor``/``previous_cursor``; the last field must be unique.
+    """
+    model = queryset.model
+    after_values = decode_cursor(model, fields, after)
+    before_values = decode_cursor(model, fields, before)
+
+    forward = [f'-{name}' if descending else name for name in fields]
+    backward = [name if descending else f'-{name}' for name in fields]
+
+    if before_values is not None:
+        # Walk back over the keys only, then fetch the page forwards from its first row so
+        # every page is read in the same direction (window annotations stay page-relative).
+        keys = list(queryset.filter(keyset_filter(fields, before_values, not descending))
+                    .order_by(*backward).values_list(*fields)[:per_page + 1])
+        if not keys:
+            return KeysetPage([], fields, has_next=True, has_previous=False)
+        has_previous = len(keys) > per_page
+        start = keys[:per_page][-1]
+        rows = list(queryset.filter(keyset_filter(fields, start, descending, inclusive=True))
+                    .order_by(*forward)[:per_page])
+        return KeysetPage(rows, fields, has_next=True, has_previous=has_previous)
+
+    if after_values is not None:
+        queryset = queryset.filter(keyset_filter(fields, after_values, descending))
+    rows = list(queryset.order_by(*forward)[:per_page + 1])
+    has_next = len(rows) > per_page
+    return KeysetPage(rows[:per_page], fields, has_next=has_next, has_previous=after_values is not None)
@@ -0,0 +1,247 @@
+import datetime
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connection, models
+from django.db.models import CharField, DateTimeField, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Concat, TruncMonth
+from django.utils import timezone
+
+from .models import Customer, Payment, PelletsPrice, RecyclingOperation
+from .pagination import decode_cursor, encode_cursor, keyset_filter
+from .singletons import get_cached
+
+# Cache scope for the aging report; invalidated when operations, payments, intakes or customers change
+PAYABLES_AGING = 'operations.payables_aging'
+# Balances move with every payment, so a missed invalidation is only ever served for a few minutes
+AGING_TIMEOUT = 5 * 60
+# Cache scope for the pellets report; invalidated when pellet sales, flakes or their costs change
+PELLETS_PROFITABILITY = 'operations.pellets_profitability'
+
+AgingRow = namedtuple('AgingRow', 'customer_id name current days_31_60 days_61_90 over_90 balance')
+
+
+def _day_start(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def _aging_rows(today):
+    decimal = DecimalField(max_digits=14, decimal_places=2)
+    zero = Value(Decimal('0.00'), output_field=decimal)
+    charged_at = 'customerin__recyclingoperation__created_at'
+    # Charges at most 30, 60 and 90 days old start on or after these instants
+    within_30, within_60, within_90 = (_day_start(today - datetime.timedelta(days=days)) for days in (30, 60, 90))
+
+    def charged(condition):
+        return Coalesce(Sum('customerin__recyclingoperation__amount', filter=condition), zero)
+
+    paid = Payment.objects.filter(customer=OuterRef('pk')).order_by().values('customer').annotate(
+        total=Sum('amount')).values('total')
+
+    customers = Customer.objects.annotate(
+        current=charged(Q(**{f'{charged_at}__gte': within_30})),
+        days_31_60=charged(Q(**{f'{charged_at}__gte': within_60, f'{charged_at}__lt': within_30})),
+        days_61_90=charged(Q(**{f'{charged_at}__gte': within_90, f'{charged_at}__lt': within_60})),
+        over_90=charged(Q(**{f'{charged_at}__lt': within_90})),
+        paid=Coalesce(Subquery(paid, output_field=decimal), zero),
+    ).values_list('pk', 'name', 'current', 'days_31_60', 'days_61_90', 'over_90', 'paid').order_by('name', 'pk')
+
+    rows = []
+    for pk, name, current, days_31_60, days_61_90, over_90, paid in customers:
+        balance = current + days_31_60 + days_61_90 + over_90 - paid
+        if not balance:
+            continue
+        # Payments settle the oldest charges first; anything left over is a credit shown as current
+        buckets = [over_90, days_61_90, days_31_60, current]
+        for index, amount in enumerate(buckets):
+            applied = min(amount, paid)
+            buckets[index] -= applied
+            paid -= applied
+        over_90, days_61_90, days_31_60, current = buckets
+        rows.append(AgingRow(pk, name, current - paid, days_31_60, days_61_90, over_90, balance))
+    return rows
+
+
+def payables_aging(today=None):
+    """
+    Outstanding balance per customer, bucketed by the age of the recycling
+    charges it is made of (0-30, 31-60, 61-90 and over 90 days). Computed with
+    one grouped query over customers and cached for a few minutes, or until
+    the data changes.
+    """
+    today = today or timezone.localdate()
+    return get_cached(PAYABLES_AGING, f'aging:{today.isoformat()}', lambda: _aging_rows(today), AGING_TIMEOUT)
+
+
+# Statement entries sort by (entry_at, entry_kind, entry_id); charges come before payments made at the same instant
+CHARGE, PAYMENT = 0, 1
+STATEMENT_KEY = ('entry_at', 'entry_kind', 'entry_id')
+STATEMENT_COLUMNS = (
+    ('entry_at', DateTimeField()),
+    ('entry_kind', IntegerField()),
+    ('entry_id', IntegerField()),
+    ('entry_text', CharField()),
+    ('charge', DecimalField(max_digits=12, decimal_places=2)),
+    ('payment', DecimalField(max_digits=12, decimal_places=2)),
+)
+
+StatementRow = namedtuple('StatementRow', 'entry_at kind id description charge payment balance')
+
+
+def _statement_branches(customer):
+    decimal = DecimalField(max_digits=12, decimal_places=2)
+    zero = Value(Decimal('0.00'), output_field=decimal)
+    # Every column is an annotation, added in the same order, so both sides of the UNION line up
+    charges = RecyclingOperation.objects.filter(customer_serial__customer=customer).annotate(
+        entry_at=F('created_at'),
+        entry_kind=Value(CHARGE),
+        entry_id=F('id'),
+        entry_text=Concat(Value('Recycling '), F('customer_serial__material_type'), output_field=CharField()),
+        charge=Coalesce(F('amount'), zero),
+        payment=zero,
+    )
+    payments = Payment.objects.filter(customer=customer).annotate(
+        entry_at=F('due_date'),
+        entry_kind=Value(PAYMENT),
+        entry_id=F('id'),
+        entry_text=F('description'),
+        charge=zero,
+        payment=F('amount'),
+    )
+    return charges, payments
+
+
+def _cents(value):
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def _balance_through(customer, key):
+    # Charges less payments for every entry at or before key
+    charges, payments = _statement_branches(customer)
+    up_to = ~keyset_filter(STATEMENT_KEY, key)
+    charged = charges.filter(up_to).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+    paid = payments.filter(up_to).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+    return _cents(charged - paid)
+
+
+def _statement_page(customer, after, limit, opening_balance):
+    names = [name for name, _ in STATEMENT_COLUMNS]
+    branches = []
+    for branch in _statement_branches(customer):
+        if after:
+            branch = branch.filter(keyset_filter(STATEMENT_KEY, after))
+        branch = branch.values_list(*names)
+        if connection.features.supports_slicing_ordering_in_compound:
+            # Each side only needs its own first rows for the merged page
+            branch = branch.order_by(*STATEMENT_KEY)[:limit]
+        branches.append(branch)
+    page = branches[0].union(branches[1], all=True).order_by(*STATEMENT_KEY)[:limit]
+
+    inner_sql, params = page.query.sql_with_params()
+    qn = connection.ops.quote_name
+    key = ', '.join(qn(name) for name in STATEMENT_KEY)
+    sql = (
+        f"SELECT {', '.join(qn(name) for name in names)}, "
+        f"SUM({qn('charge')} - {qn('payment')}) OVER (ORDER BY {key}) "
+        f"FROM ({inner_sql}) {qn('statement_page')} ORDER BY {key}"
+    )
+    converters = [
+        connection.ops.get_db_converters(Value(None, output_field=field)) for _, field in STATEMENT_COLUMNS
+    ]
+    converters.append(converters[-1])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = []
+        for raw in cursor.fetchall():
+            values = []
+            for value, column_converters in zip(raw, converters):
+                for converter in column_converters:
+                    value = converter(value, None, connection)
+                values.append(value)
+            entry_at, kind, pk, text, charge, payment, running = values
+            rows.append(StatementRow(entry_at, kind, pk, text, _cents(charge), _cents(payment),
+                                     _cents(opening_balance + Decimal(running))))
+    return rows
+
+
+def _cursor_fields():
+    return [field for name, field in STATEMENT_COLUMNS if name in STATEMENT_KEY]
+
+
+def customer_statement(customer, cursor=None, per_page=50):
+    """
+    One page of a customer's statement: recycling charges and payments merged
+    with a UNION in date order, with the running balance from a window
+    function. Returns (rows, opening_balance, next_cursor).
+    """
+    after = decode_cursor(None, _cursor_fields(), cursor)
+    opening_balance = _balance_through(customer, after) if after else Decimal('0.00')
+    rows = _statement_page(customer, after, per_page + 1, opening_balance)
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1][:3])
+    return rows, opening_balance, next_cursor
+
+
+def iter_customer_statement(customer, chunk_size=1000):
+    """Every statement row, fetched a chunk at a time with the balance carried across chunks."""
+    after, balance = None, Decimal('0.00')
+    while True:
+        rows = _statement_page(customer, after, chunk_size, balance)
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after, balance = rows[-1][:3], rows[-1].balance
+
+
+ProfitabilityRow = namedtuple(
+    'ProfitabilityRow',
+    'month flakes_type sales flakes_quantity pellets_quantity revenue cost profit margin pellet_yield'
+)
+
+
+def _ratio(numerator, denominator):
+    return (numerator / denominator * 100).quantize(Decimal('0.01')) if denominator else None
+
+
+def _profitability_rows(year):
+    decimal = DecimalField(max_digits=14, decimal_places=2)
+    zero = Value(Decimal('0.00'), output_field=decimal)
+    sales = PelletsPrice.objects.filter(date__year=year).annotate(month=TruncMonth('date')).values(
+        'month', 'serial__flakes_type',
+    ).annotate(
+        sales=models.Count('pk'),
+        flakes_quantity=Coalesce(Sum('serial__flakes_quantity'), zero),
+        pellets_quantity=Coalesce(Sum('pellets_quantity'), zero),
+        revenue=Coalesce(Sum('price'), zero),
+        # Same cost basis as PelletsPrice.profit: the flakes' purchase cost plus their processing cost
+        cost=Coalesce(Sum(Coalesce('serial__total_cost1', zero) + Coalesce('cost_id__total_cost2', zero)), zero),
+    ).values_list(
+        'month', 'serial__flakes_type', 'sales', 'flakes_quantity', 'pellets_quantity', 'revenue', 'cost',
+    ).order_by('month', 'serial__flakes_type')
+
+    return [
+        ProfitabilityRow(month, flakes_type, count, flakes, pellets, revenue, cost, revenue - cost,
+                         _ratio(revenue - cost, revenue), _ratio(pellets, flakes))
+        for month, flakes_type, count, flakes, pellets, revenue, cost in sales
+    ]
+
+
+def pellets_profitability(year):
+    """
+    Pellet sales for a year grouped by month and flakes type, with revenue,
+    cost, profit, margin (% of revenue) and yield (pellets per unit of flakes,
+    %). One grouped query per year, cached until the underlying rows change.
+    """
+    return get_cached(PELLETS_PROFITABILITY, f'year:{year}', lambda: _profitability_rows(year))
+
+
+def profitability_totals(rows):
+    totals = {field: sum((getattr(row, field) for row in rows), Decimal('0.00'))
+              for field in ('flakes_quantity', 'pellets_quantity', 'revenue', 'cost', 'profit')}
+    totals['sales'] = sum(row.sales for row in rows)
+    totals['margin'] = _ratio(totals['profit'], totals['revenue'])
+    totals['pellet_yield'] = _ratio(totals['pellets_quantity'], totals['flakes_quantity'])
+    return totals
@@ -0,0 +1,69 @@
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+
+from .models import CustomerIn, FlakesIn, SerialSequence
+
+# Values each worker reserves per round trip to the sequence table
+BLOCK_SIZE = 50
+SAVE_ATTEMPTS = 5
+
+# name -> [next value, end of block]; values left in a block when the process exits are skipped
+_blocks = {}
+_lock = threading.Lock()
+
+
+def reserve_block(name, size=BLOCK_SIZE, seed=1):
+    """
+    Take the next ``size`` values of a named sequence with one locked
+    read-and-bump of its SerialSequence row. ``seed`` (a value or callable)
+    is where a sequence that doesn't exist yet starts.
+    """
+    with transaction.atomic():
+        sequence, _ = SerialSequence.objects.select_for_update().get_or_create(
+            name=name, defaults={'next_value': seed}
+        )
+        start = sequence.next_value
+        sequence.next_value = start + size
+        sequence.save(update_fields=['next_value'])
+    return start, start + size
+
+
+def next_serial(name, seed=1):
+    # Served from this worker's block; only an exhausted block goes back to the database
+    with _lock:
+        block = _blocks.get(name)
+        if block is None or block[0] >= block[1]:
+            block = _blocks[name] = list(reserve_block(name, seed=seed))
+        value = block[0]
+        block[0] += 1
+    return value
+
+
+def _next_customer_serial():
+    return (CustomerIn.objects.aggregate(top=Max('customer_serial'))['top'] or 0) + 1
+
+
+def next_customer_serial():
+    return next_serial('customer_in', seed=_next_customer_serial)
+
+
+def next_flakes_serial():
+    return f"FL{next_serial('flakes_in', seed=lambda: FlakesIn.objects.count() + 1):06d}"
+
+
+def save_with_serial(form, field, allocate):
+    """
+    Save a model form with a freshly allocated serial in ``field``. A serial
+    that is already taken (a hand-entered legacy row, or a block reissued
+    after a rollback) fails on the unique index and the next one is tried.
+    """
+    for attempt in range(SAVE_ATTEMPTS):
+        setattr(form.instance, field, allocate())
+        try:
+            with transaction.atomic():
+                return form.save()
+        except IntegrityError:
+            if attempt == SAVE_ATTEMPTS - 1:
+                raise
@@ -0,0 +1,353 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (AccountPayable, BalanceCheckpoint, CustomerIn, CustomerInRollup, Electricity,
+                     ElectricityTariff, GeneralExpensesAccount, InitialMeterReading, MeterHead, PayrollPeriod,
+                     PayrollStatement, RecyclingOperation, Salary, SalaryPayment, Transaction)
+from .pagination import keyset_filter
+from .reports import PAYABLES_AGING
+from .singletons import invalidate_singleton
+
+# Salary accrued per unit of material_used, by role
+SALARY_RATES = (
+    ('manager', Decimal('3.0')),
+    ('operator', Decimal('4.0')),
+    ('packer', Decimal('3.0')),
+)
+
+
+class InsufficientBalance(ValueError):
+    pass
+
+
+class OverlappingPayrollPeriod(ValueError):
+    pass
+
+
+def post_transaction(amount, transaction_type, description, account=None):
+    """
+    Post a credit or debit to the general expenses account.
+
+    The account row is locked for the duration of the posting, the balance is
+    changed with a conditional F() update and the Transaction is written in the
+    same database transaction, so concurrent workers can't lose updates or
+    overdraw the account.
+    """
+    with transaction.atomic():
+        accounts = GeneralExpensesAccount.objects.select_for_update()
+        account = accounts.get(pk=account.pk) if account else accounts.order_by('pk').first()
+
+        if transaction_type == 'credit':
+            account.credit(amount)
+        elif transaction_type == 'debit':
+            try:
+                account.debit(amount)
+            except ValueError:
+                raise InsufficientBalance("Insufficient balance")
+        else:
+            raise ValueError(f"Unknown transaction type: {transaction_type}")
+
+        entry = Transaction.objects.create(
+            account=account,
+            amount=amount,
+            description=description,
+            transaction_type=transaction_type,
+        )
+        BalanceCheckpoint.after_posting(entry)
+
+    return entry
+
+
+def accrue(model, lookup, field, delta, **extra):
+    """
+    Increment-or-create: one UPDATE when the row exists, an INSERT the first
+    time. The lookup must be unique, so a concurrent first INSERT fails and the
+    increment is retried as an UPDATE on the row that won.
+    """
+    changes = {field: F(field) + delta, **extra}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **{field: delta})
+    except IntegrityError:
+        model.objects.filter(**lookup).update(**changes)
+
+
+def operation_accruals(operations):
+    """
+    Sum what a set of recycling operations adds to each staff member's salary
+    and each customer's payable, so every row is touched once per posting.
+    """
+    salaries = defaultdict(Decimal)
+    payables = defaultdict(Decimal)
+    for operation in operations:
+        if operation.material_used is not None:
+            for role, rate in SALARY_RATES:
+                staff_id = getattr(operation, f'{role}_id')
+                if staff_id:
+                    salaries[staff_id] += operation.material_used * rate
+        if operation.customer_serial_id and operation.amount is not None:
+            payables[operation.customer_serial.customer_id] += operation.amount
+    return salaries, payables
+
+
+def apply_accruals(salaries, payables):
+    salaries = dict(salaries)
+    if len(salaries) > 1:
+        # Staff who already have a salary row go up together in one UPDATE; the rest are created below
+        existing = list(Salary.objects.filter(staff_id__in=salaries).values_list('staff_id', flat=True))
+        if existing:
+            Salary.objects.filter(staff_id__in=existing).update(amount1=F('amount1') + Case(
+                *(When(staff_id=staff_id, then=Value(salaries.pop(staff_id))) for staff_id in existing),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ))
+    for staff_id, amount in salaries.items():
+        accrue(Salary, {'staff_id': staff_id}, 'amount1', amount)
+    now = timezone.now()
+    for customer_id, amount in payables.items():
+        accrue(AccountPayable, {'customer_id': customer_id}, 'amount', amount, due_date=now)
+
+
+def record_payment(payment):
+    """Save a customer payment and take it off their payable in one transaction."""
+    with transaction.atomic():
+        payment.save()
+        accrue(AccountPayable, {'customer_id': payment.customer_id}, 'amount', -payment.amount)
+    return payment
+
+
+def post_recycling_operation(operation):
+    """
+    Save a recycling operation together with the salary accruals and the
+    customer payable it generates, as one database transaction.
+    """
+    with transaction.atomic():
+        apply_accruals(*operation_accruals([operation]))
+        operation.save()
+    return operation
+
+
+def post_recycling_operations(operations):
+    """
+    Batch form of post_recycling_operation: accruals are summed per staff
+    member and customer up front and the operations go in with one bulk_create.
+    """
+    with transaction.atomic():
+        apply_accruals(*operation_accruals(operations))
+        created = RecyclingOperation.objects.bulk_create(operations)
+        # bulk_create sends no post_save, so the intake rollups and the aging report are handled here
+        apply_rollups(rollup_deltas(operations))
+        transaction.on_commit(lambda: invalidate_singleton(PAYABLES_AGING))
+        return created
+
+
+def rollup_deltas(operations, sign=1):
+    """
+    Per-intake change to CustomerInRollup from adding (sign=1) or removing
+    (sign=-1) the given operations, as {customer_in_id: delta dict}.
+    """
+    deltas = {}
+    for operation in operations:
+        delta = deltas.setdefault(operation.customer_serial_id, defaultdict(Decimal))
+        used = (operation.material_used or 0) * sign
+        bangori = (operation.bangori or 0) * sign
+        delta['material_used'] += used
+        delta['bangori'] += bangori
+        delta['material_lost'] -= used + bangori
+        delta['amount'] += (operation.amount or 0) * sign
+        delta['operation_count'] += sign
+    return deltas
+
+
+def apply_rollups(deltas):
+    for customer_in_id, delta in deltas.items():
+        changes = {field: F(field) + value for field, value in delta.items()}
+        if CustomerInRollup.objects.filter(customer_in_id=customer_in_id).update(**changes):
+            continue
+        if delta['operation_count'] <= 0:
+            # Removing operations from an intake that has no rollup (or is itself being deleted)
+            continue
+        try:
+            with transaction.atomic():
+                quantity = CustomerIn.objects.values_list('material_quantity', flat=True).get(pk=customer_in_id)
+                CustomerInRollup.objects.create(
+                    customer_in_id=customer_in_id,
+                    material_used=delta['material_used'],
+                    bangori=delta['bangori'],
+                    material_lost=quantity + delta['material_lost'],
+                    amount=delta['amount'],
+                    operation_count=delta['operation_count'],
+                )
+        except IntegrityError:
+            # Another posting created the row first
+            CustomerInRollup.objects.filter(customer_in_id=customer_in_id).update(**changes)
+
+
+def refresh_electricity_variance(readings):
+    # Operations store their variance against the reading's cost, so it is refreshed whenever a reading is repriced
+    decimal = DecimalField(max_digits=10, decimal_places=2)
+    reading_cost = Subquery(
+        Electricity.objects.filter(pk=OuterRef('meter_ID')).values('electricity_cost'), output_field=decimal
+    )
+    zero = Value(Decimal('0.00'), output_field=decimal)
+    RecyclingOperation.objects.filter(meter_ID__in=readings).update(
+        electricity_variance=Coalesce(F('standard_electricity_cost'), zero) - Coalesce(reading_cost, zero)
+    )
+
+
+def price_reading(reading, previous_meter_reading):
+    # Consumption since the previous reading, at the tariff in force on the reading's date
+    reading.previous_meter_reading = previous_meter_reading
+    reading.electricity_consumption = reading.meter_reading - previous_meter_reading
+    cost_per_unit = ElectricityTariff.cost_per_unit_on(reading.date)
+    reading.electricity_cost = (
+        reading.electricity_consumption * cost_per_unit if cost_per_unit is not None else None
+    )
+
+
+def meter_readings(meter_ID):
+    # Newest first, served by the (meter_ID, date, shift) index
+    return Electricity.objects.filter(meter_ID=meter_ID).order_by('-date', '-shift', '-id')
+
+
+def is_after(reading, other):
+    return (reading.date, reading.shift) >= (other.date, other.shift)
+
+
+def record_meter_reading(reading):
+    """
+    Fill in previous reading, consumption and cost for a new Electricity
+    reading and save it, under the lock of its meter's MeterHead row.
+
+    In-order captures take the previous reading straight from the head; a
+    back-dated capture looks up its predecessor on the meter's index and
+    re-prices the reading that follows it, which now starts from this one.
+    """
+    with transaction.atomic():
+        head, _ = MeterHead.objects.select_for_update().select_related('latest').get_or_create(
+            meter_ID=reading.meter_ID
+        )
+        if head.latest is None:
+            # New head, or its reading was deleted
+            head.latest = meter_readings(reading.meter_ID).first()
+
+        if head.latest is None or is_after(reading, head.latest):
+            previous = head.latest
+        else:
+            previous = meter_readings(reading.meter_ID).filter(
+                keyset_filter(('date', 'shift'), (reading.date, reading.shift), descending=True, inclusive=True)
+            ).first()
+        initial_meter_reading = InitialMeterReading.cached()
+
+        # A meter's first reading starts from the configured initial reading, if there is one
+        if previous:
+            price_reading(reading, previous.meter_reading)
+        elif initial_meter_reading:
+            price_reading(reading, initial_meter_reading.initial_reading)
+        else:
+            price_reading(reading, reading.meter_reading)
+        reading.save()
+
+        if head.latest is None or is_after(reading, head.latest):
+            head.latest = reading
+        else:
+            following = Electricity.objects.filter(meter_ID=reading.meter_ID).filter(
+                keyset_filter(('date', 'shift'), (reading.date, reading.shift))
+            ).order_by('date', 'shift', 'id').first()
+            if following is not None:
+                price_reading(following, reading.meter_reading)
+                following.save(update_fields=['previous_meter_reading', 'electricity_consumption', 'electricity_cost'])
+                refresh_electricity_variance([following])
+            else:
+                # The head no longer matches the meter's readings (edited or deleted since); find the latest again
+                head.latest = meter_readings(reading.meter_ID).first()
+        head.save(update_fields=['latest'])
+    return reading
+
+
+def period_earnings(start, end):
+    """
+    Material processed and operation count per staff member for operations
+    whose reading falls in [start, end], as one UNION of per-role GROUP BYs.
+    Yields (role, staff_id, name, material_used, operation_count).
+    """
+    operations = RecyclingOperation.objects.filter(meter_ID__date__range=(start, end))
+    grouped = [
+        operations.values(staff=F(f'{role}_id'), staff_name=F(f'{role}__name')).annotate(
+            role_name=Value(role), total_material=Sum('material_used'), total_operations=Count('id'),
+        ).values_list('role_name', 'staff', 'staff_name', 'total_material', 'total_operations').order_by()
+        for role, _ in SALARY_RATES
+    ]
+    return grouped[0].union(*grouped[1:], all=True)
+
+
+def close_payroll_period(start, end):
+    """
+    Write the payroll statements for [start, end]. Rerunning for the same
+    period (after corrections) replaces its statements and moves each staff
+    member's running accrual by the change in their earnings for the period,
+    so the close is idempotent and touches nothing outside the period: the
+    accrual already took the operations in as they were posted, and a balance
+    entered by hand or carried over is kept. A period overlapping another
+    closed one is refused so no operation is paid twice.
+    """
+    rates = dict(SALARY_RATES)
+    with transaction.atomic():
+        overlapping = PayrollPeriod.objects.filter(start__lte=end, end__gte=start).exclude(start=start, end=end)
+        if overlapping.exists():
+            raise OverlappingPayrollPeriod(f"{overlapping.first()} overlaps {start} to {end}")
+        period, created = PayrollPeriod.objects.get_or_create(start=start, end=end)
+        adjustments = defaultdict(Decimal)
+        if not created:
+            # Serialise concurrent closes of the same period
+            period = PayrollPeriod.objects.select_for_update().get(pk=period.pk)
+            for staff_id, earnings in period.statements.values_list('staff_id', 'earnings'):
+                adjustments[staff_id] -= earnings
+            period.statements.all().delete()
+
+        statements = PayrollStatement.objects.bulk_create([
+            PayrollStatement(
+                period=period, role=role, staff_id=staff_id, name=name, material_used=material_used,
+                operation_count=operation_count, earnings=material_used * rates[role],
+            )
+            for role, staff_id, name, material_used, operation_count in period_earnings(start, end)
+        ])
+
+        if not created:
+            for statement in statements:
+                adjustments[statement.staff_id] += statement.earnings
+            apply_accruals({staff_id: amount for staff_id, amount in adjustments.items() if amount}, {})
+
+        period.save(update_fields=['closed_at'])
+    return period, statements
+
+
+def pay_outstanding_salaries(description):
+    """
+    Pay every staff member's outstanding accrual in one go: the Salary rows
+    are locked, one SalaryPayment per person is bulk-created, the accruals are
+    zeroed with one UPDATE and the total is posted to the ledger as a single
+    debit. Returns the payments made.
+    """
+    with transaction.atomic():
+        outstanding = list(
+            Salary.objects.select_for_update().filter(amount1__gt=0).values_list('pk', 'staff_id', 'amount1')
+        )
+        total = sum((amount for _, _, amount in outstanding), Decimal('0.00'))
+        if not total:
+            return []
+
+        post_transaction(total, 'debit', description)
+
+        payments = SalaryPayment.objects.bulk_create([
+            SalaryPayment(staff_id=staff_id, amount1=amount, description=description)
+            for _, staff_id, amount in outstanding
+        ])
+        Salary.objects.filter(pk__in=[pk for pk, _, _ in outstanding]).update(amount1=Decimal('0.0'))
+    return payments
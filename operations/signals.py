@@ -0,0 +1,75 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import (Customer, CustomerIn, CustomerInRollup, ElectricityConfiguration, ElectricityTariff, FlakesCost,
+                     FlakesIn, InitialMeterReading, Payment, PelletsPrice, RecyclingOperation)
+from .reports import PAYABLES_AGING, PELLETS_PROFITABILITY
+from .services import apply_rollups, rollup_deltas
+from .singletons import invalidate_singleton
+
+
+def invalidate_cached_singleton(sender, **kwargs):
+    # Once committed, so no worker caches the old rows again in between
+    transaction.on_commit(lambda: invalidate_singleton(sender))
+
+
+for model in (ElectricityConfiguration, ElectricityTariff, InitialMeterReading):
+    post_save.connect(invalidate_cached_singleton, sender=model, dispatch_uid=f'invalidate-{model.__name__}-save')
+    post_delete.connect(invalidate_cached_singleton, sender=model, dispatch_uid=f'invalidate-{model.__name__}-delete')
+
+
+def invalidate_payables_aging(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_singleton(PAYABLES_AGING))
+
+
+# An intake moved to another customer moves its charges with it
+for model in (RecyclingOperation, Payment, Customer, CustomerIn):
+    post_save.connect(invalidate_payables_aging, sender=model, dispatch_uid=f'aging-{model.__name__}-save')
+    post_delete.connect(invalidate_payables_aging, sender=model, dispatch_uid=f'aging-{model.__name__}-delete')
+
+
+def invalidate_pellets_profitability(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_singleton(PELLETS_PROFITABILITY))
+
+
+for model in (PelletsPrice, FlakesIn, FlakesCost):
+    post_save.connect(invalidate_pellets_profitability, sender=model,
+                      dispatch_uid=f'profitability-{model.__name__}-save')
+    post_delete.connect(invalidate_pellets_profitability, sender=model,
+                        dispatch_uid=f'profitability-{model.__name__}-delete')
+
+
+def remember_operation_before_edit(sender, instance, raw=False, **kwargs):
+    instance._rollup_previous = None
+    if instance.pk and not raw:
+        instance._rollup_previous = RecyclingOperation.objects.filter(pk=instance.pk).only(
+            'customer_serial', 'material_used', 'bangori', 'amount'
+        ).first()
+
+
+def rollup_saved_operation(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        # A correction: take the old figures out before adding the new ones
+        apply_rollups(rollup_deltas([previous], sign=-1))
+    apply_rollups(rollup_deltas([instance]))
+
+
+def rollup_deleted_operation(sender, instance, **kwargs):
+    apply_rollups(rollup_deltas([instance], sign=-1))
+
+
+def rollup_intake_quantity(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        CustomerInRollup.objects.filter(customer_in=instance).update(
+            material_lost=instance.material_quantity - F('material_used') - F('bangori')
+        )
+
+
+pre_save.connect(remember_operation_before_edit, sender=RecyclingOperation, dispatch_uid='rollup-operation-pre-save')
+post_save.connect(rollup_saved_operation, sender=RecyclingOperation, dispatch_uid='rollup-operation-save')
+post_delete.connect(rollup_deleted_operation, sender=RecyclingOperation, dispatch_uid='rollup-operation-delete')
+post_save.connect(rollup_intake_quantity, sender=CustomerIn, dispatch_uid='rollup-intake-save')
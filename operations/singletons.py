@@ -0,0 +1,87 @@
+import copy
+import time
+import uuid
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+SINGLETON_TIMEOUT = 60 * 60 * 24
+# How long a worker trusts its own copy when there is no shared cache to hear about changes from other workers
+LOCAL_TIMEOUT = 60
+
+# (label, name) -> (token, expires, value)
+_local = {}
+
+
+def _keys(model):
+    # A model, or a plain label for values derived from several tables
+    label = model if isinstance(model, str) else model._meta.label_lower
+    return label, f'singleton:{label}:token'
+
+
+def _shared():
+    # Only a cache every worker sees (Redis) can carry an invalidation to the other workers
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def get_cached(model, name, load, timeout=SINGLETON_TIMEOUT):
+    """
+    Return ``load()`` for a small, rarely-changing table, cached per model.
+
+    The value is kept in this process. With a shared cache configured it is
+    also stored there under a token that invalidate_singleton() replaces, so
+    a warm lookup costs one cache read and every worker sees a change on its
+    next request. Without one, each worker keeps its copy for LOCAL_TIMEOUT
+    at most and a warm lookup costs nothing. Callers get their own copy.
+    """
+    label, token_key = _keys(model)
+    local = _local.get((label, name))
+
+    if not _shared():
+        if local is None or local[1] <= time.monotonic():
+            local = (None, time.monotonic() + min(timeout, LOCAL_TIMEOUT), load())
+            _local[label, name] = local
+        return copy.deepcopy(local[2])
+
+    token = cache.get(token_key)
+    if token is None:
+        cache.add(token_key, uuid.uuid4().hex, SINGLETON_TIMEOUT)
+        token = cache.get(token_key)
+
+    if local is not None and local[0] == token and local[1] > time.monotonic():
+        return copy.deepcopy(local[2])
+
+    value_key = f'singleton:{label}:{name}:{token}'
+    cached = cache.get(value_key)
+    if cached is None:
+        # Wrapped in a tuple so an empty result is cached too
+        cached = (load(),)
+        cache.set(value_key, cached, timeout)
+
+    _local[label, name] = (token, time.monotonic() + timeout, cached[0])
+    return copy.deepcopy(cached[0])
+
+
+def get_singleton(model):
+    # First row of a single-row settings table
+    return get_cached(model, 'row', lambda: model.objects.order_by('pk').first())
+
+
+def invalidate_singleton(model):
+    label, token_key = _keys(model)
+    if _shared():
+        cache.set(token_key, uuid.uuid4().hex, SINGLETON_TIMEOUT)
+    for key in [key for key in _local if key[0] == label]:
+        _local.pop(key, None)
+
+
+def reset_singletons():
+    # Forget every cached value, here and in the shared cache; for tests, whose rolled-back rows may still be cached
+    _local.clear()
+    cache.clear()
+
+
+class CachedSingletonMixin:
+    @classmethod
+    def cached(cls):
+        return get_singleton(cls)
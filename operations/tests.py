@@ -1,3 +1,843 @@
-from django.test import TestCase
+import datetime
+import io
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F, Max, Sum
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import serials
+from .importers import LedgerImportError, import_ledger, validate_ledger
+from .models import (AccountPayable, BalanceCheckpoint, Customer, CustomerIn, CustomerInRollup, Electricity,
+                     ElectricityConfiguration, ElectricityTariff, FlakesCost, FlakesIn, GeneralExpensesAccount,
+                     MeterHead, Payment, PayrollPeriod, PayrollStatement, PelletsPrice, RecyclingOperation, Salary,
+                     SalaryPayment, SerialSequence, Staff, Transaction, signed_amount)
+from .services import (InsufficientBalance, OverlappingPayrollPeriod, apply_accruals, close_payroll_period,
+                       post_transaction, record_meter_reading, record_payment)
+from .reports import customer_statement, payables_aging, pellets_profitability
+from .singletons import LOCAL_TIMEOUT, reset_singletons
+
+
+class OperationsTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        reset_singletons()
+
+
+class PostTransactionTests(OperationsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = GeneralExpensesAccount.objects.create(balance=Decimal('100.00'))
+
+    def test_credit_and_debit_move_balance(self):
+        post_transaction(Decimal('50.00'), 'credit', 'Top up')
+        post_transaction(Decimal('30.00'), 'debit', 'Diesel')
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('120.00'))
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_overdraft_is_rejected_without_posting(self):
+        with self.assertRaises(InsufficientBalance):
+            post_transaction(Decimal('100.01'), 'debit', 'Too much')
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('100.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+
+class BalanceCheckpointTests(OperationsTestCase):
+    def recomputed_balance_as_of(self, date):
+        return Transaction.objects.filter(created_at__date__lte=date).aggregate(
+            total=Sum(signed_amount()))['total'] or Decimal('0.00')
+
+    def test_checkpoints_across_the_interval_match_a_full_recompute(self):
+        account = GeneralExpensesAccount.objects.create(balance=Decimal('0.00'))
+        start = timezone.now() - datetime.timedelta(days=10)
+        with mock.patch.object(BalanceCheckpoint, 'INTERVAL', 4):
+            for index in range(10):
+                posted_at = start + datetime.timedelta(days=index)
+                with mock.patch.object(Transaction._meta.get_field('created_at'), 'default', lambda: posted_at):
+                    post_transaction(Decimal('10.00'), 'credit', f'Deposit {index}')
+                    if index % 3 == 2:
+                        post_transaction(Decimal('7.00'), 'debit', f'Spend {index}')
+
+            self.assertEqual(list(BalanceCheckpoint.objects.order_by('created_at').values_list('balance', flat=True)),
+                             [Decimal('23.00'), Decimal('46.00'), Decimal('69.00')])
+            for day in range(11):
+                as_of = timezone.localdate(start + datetime.timedelta(days=day))
+                self.assertEqual(account.balance_as_of(as_of), self.recomputed_balance_as_of(as_of))
+
+            self.assertEqual(account.balance_as_of(timezone.localdate(start + datetime.timedelta(days=4))),
+                             Decimal('43.00'))
+
+            # Editing history out of band leaves the checkpoints stale until they are rebuilt
+            Transaction.objects.filter(description='Deposit 1').update(amount=Decimal('50.00'))
+            BalanceCheckpoint.rebuild(account)
+            self.assertEqual(BalanceCheckpoint.objects.count(), 3)
+            for day in range(11):
+                as_of = timezone.localdate(start + datetime.timedelta(days=day))
+                self.assertEqual(account.balance_as_of(as_of), self.recomputed_balance_as_of(as_of))
+
+
+class SingletonCacheTests(OperationsTestCase):
+    def test_callers_get_their_own_copy(self):
+        ElectricityConfiguration.objects.create(fixed_cost_per_unit=Decimal('5.00'))
+        ElectricityConfiguration.cached().fixed_cost_per_unit = Decimal('9.00')
+        self.assertEqual(ElectricityConfiguration.cached().fixed_cost_per_unit, Decimal('5.00'))
+
+    def test_warm_lookup_runs_no_query_until_the_local_copy_expires(self):
+        ElectricityConfiguration.objects.create(fixed_cost_per_unit=Decimal('5.00'))
+        ElectricityConfiguration.cached()
+        with self.assertNumQueries(0):
+            ElectricityConfiguration.cached()
+
+        # Sends no signal, like a change saved by another worker
+        ElectricityConfiguration.objects.update(fixed_cost_per_unit=Decimal('9.00'))
+        self.assertEqual(ElectricityConfiguration.cached().fixed_cost_per_unit, Decimal('5.00'))
+        with mock.patch('operations.singletons.time.monotonic', return_value=time.monotonic() + LOCAL_TIMEOUT):
+            self.assertEqual(ElectricityConfiguration.cached().fixed_cost_per_unit, Decimal('9.00'))
+
+    def test_saving_invalidates_once_committed(self):
+        configuration = ElectricityConfiguration.objects.create(fixed_cost_per_unit=Decimal('5.00'))
+        ElectricityConfiguration.cached()
+        configuration.fixed_cost_per_unit = Decimal('9.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            configuration.save()
+        self.assertEqual(ElectricityConfiguration.cached().fixed_cost_per_unit, Decimal('9.00'))
+
+    def test_home_page_reads_the_live_balance(self):
+        user = get_user_model().objects.create_user('clerk', 'clerk@example.com', 'password')
+        GeneralExpensesAccount.objects.create(balance=Decimal('100.00'))
+        self.client.force_login(user)
+        self.client.get(reverse('index'))
+
+        post_transaction(Decimal('25.00'), 'credit', 'Top up')
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['account'].balance, Decimal('125.00'))
+
+
+class LedgerViewTests(OperationsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = GeneralExpensesAccount.objects.create(balance=Decimal('0.00'))
+        admin = get_user_model().objects.create_superuser('owner', 'owner@example.com', 'password')
+        self.client.force_login(admin)
+
+    def add_transactions(self, count):
+        start = timezone.now() - datetime.timedelta(days=count)
+        Transaction.objects.bulk_create(
+            Transaction(account=self.account, amount=Decimal('10.00'), description=f'Deposit {index}',
+                        transaction_type='credit', created_at=start + datetime.timedelta(hours=index))
+            for index in range(count)
+        )
+
+    def test_ledger_pages_cost_the_same_however_deep(self):
+        self.add_transactions(3)
+        # session and user, the account, the page, then the checkpoint and tail sum for the balance brought forward
+        with self.assertNumQueries(6):
+            self.client.get(reverse('transaction-list'))
+
+        self.add_transactions(120)
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('transaction-list'))
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('transaction-list'), {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(response.context['page_obj'].object_list[0].running_balance, Decimal('510.00'))
+
+    def test_export_streams_in_fixed_queries(self):
+        def export():
+            response = self.client.get(reverse('export-ledger'))
+            return b''.join(response.streaming_content).decode().splitlines()
+
+        self.add_transactions(3)
+        # session and user, the account, then the single streamed ledger query
+        with self.assertNumQueries(4):
+            export()
+
+        self.add_transactions(120)
+        with self.assertNumQueries(4):
+            lines = export()
+        self.assertEqual(len(lines), 124)
+        self.assertTrue(lines[-1].endswith(',1230.00'))
+
+
+# Needs real row locks, so it only runs against PostgreSQL (DATABASE_URL=postgres://... manage.py test); SQLite
+# serialises whole-database writes and fails the threads with "database is locked" instead of queueing them
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentPostingTests(TransactionTestCase):
+    workers = 8
+    postings_per_worker = 25
+
+    def test_parallel_postings_keep_balance_equal_to_ledger(self):
+        account = GeneralExpensesAccount.objects.create(balance=Decimal('0.00'))
+        errors = []
+
+        def worker(index):
+            try:
+                for _ in range(self.postings_per_worker):
+                    post_transaction(Decimal('2.00'), 'credit', f'Worker {index}')
+                    try:
+                        post_transaction(Decimal('1.00'), 'debit', f'Worker {index}')
+                    except InsufficientBalance:
+                        pass
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        account.refresh_from_db()
+        ledger_total = Transaction.objects.filter(account=account).aggregate(total=Sum(signed_amount()))['total']
+        self.assertEqual(account.balance, ledger_total)
+        self.assertEqual(account.balance, Decimal('1.00') * self.workers * self.postings_per_worker)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentAccrualTests(TransactionTestCase):
+    workers = 8
+    postings_per_worker = 25
+
+    def test_parallel_accruals_and_payments_stay_exact(self):
+        customer = Customer.objects.create(name='Bello', phone_number='0800')
+        operator = Staff.objects.create(name='Ade', phone_number='0802', role='operator')
+        errors = []
+        start = threading.Barrier(self.workers)
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.postings_per_worker):
+                    with transaction.atomic():
+                        apply_accruals({operator.pk: Decimal('4.00')}, {customer.pk: Decimal('3.00')})
+                    record_payment(Payment(customer=customer, amount=Decimal('1.00'), description='Part payment'))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        postings = self.workers * self.postings_per_worker
+        self.assertEqual(AccountPayable.objects.get(customer=customer).amount, Decimal('2.00') * postings)
+        self.assertEqual(Salary.objects.get(staff=operator).amount1, Decimal('4.00') * postings)
+
+
+class LedgerImportTests(OperationsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = GeneralExpensesAccount.objects.create(balance=Decimal('100.00'))
+
+    def write_csv(self, text):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'ledger.csv'
+        path.write_text('amount,transaction_type,description,date\n' + text)
+        return path
+
+    def test_dry_run_validates_without_writing(self):
+        path = self.write_csv('50.00,credit,Deposit,2024-01-02\n')
+        out = io.StringIO()
+        call_command('import_ledger', str(path), '--dry-run', stdout=out)
+
+        self.assertIn('1 rows in 1 batches are valid; closing balance 150.00', out.getvalue())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_back_dated_rows_keep_their_dates_and_checkpoints(self):
+        post_transaction(Decimal('10.00'), 'credit', 'Today')
+        rows = ''.join(f'{index}.00,credit,Deposit {index},2024-01-{index:02d}\n' for index in range(1, 8))
+        path = self.write_csv(rows + '3.00,debit,Bank charge,2024-01-08T09:30:00\n')
+
+        with mock.patch.object(BalanceCheckpoint, 'INTERVAL', 3):
+            call_command('import_ledger', str(path), '--chunk-size', '3', stdout=io.StringIO())
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('135.00'))
+        self.assertEqual(Transaction.objects.get(description='Deposit 4').created_at.date(), datetime.date(2024, 1, 4))
+        self.assertEqual(BalanceCheckpoint.objects.count(), 3)
+        for day in range(1, 10):
+            as_of = datetime.date(2024, 1, day)
+            recomputed = Transaction.objects.filter(created_at__date__lte=as_of).aggregate(
+                total=Sum(signed_amount()))['total'] or Decimal('0.00')
+            self.assertEqual(self.account.balance_as_of(as_of), recomputed)
+
+    def test_rejects_bad_and_future_dates(self):
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        path = self.write_csv(f'5.00,credit,Typo,2024-13-01\n5.00,credit,Early,{tomorrow}\n')
+
+        with self.assertRaisesMessage(CommandError, 'Line 2: date must be an ISO date or timestamp'):
+            call_command('import_ledger', str(path), stdout=io.StringIO())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_balance_moved_since_validation_rolls_back_the_whole_file(self):
+        rows = [(1, {'amount': '10.00', 'transaction_type': 'credit'}),
+                (2, {'amount': '90.00', 'transaction_type': 'debit'})]
+        validate_ledger(iter(rows), 1, self.account.balance)
+        post_transaction(Decimal('100.00'), 'debit', 'Spent meanwhile')
+
+        with self.assertRaises(LedgerImportError):
+            import_ledger(iter(rows), chunk_size=1)
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('0.00'))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_upload_needs_the_add_transaction_permission(self):
+        user = get_user_model().objects.create_user('clerk', 'clerk@example.com', 'password')
+        self.client.force_login(user)
+        upload = SimpleUploadedFile('ledger.csv', b'amount,transaction_type,description\n25.00,credit,Float\n')
+        data = {'file': upload, 'file_format': 'csv'}
+        self.assertEqual(self.client.post(reverse('import-ledger'), data).status_code, 403)
+
+        user.user_permissions.add(Permission.objects.get(codename='add_transaction'))
+        upload.seek(0)
+        response = self.client.post(reverse('import-ledger'), data)
+
+        self.assertEqual(response.context['imported'], 1)
+        self.assertEqual(GeneralExpensesAccount.objects.get().balance, Decimal('125.00'))
+
+
+class RecyclingTestCase(OperationsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('supervisor', 'supervisor@example.com', 'password')
+        cls.electricity = Electricity.objects.create(
+            user=cls.user, meter_ID='M1', date=datetime.date(2024, 1, 1), shift=1, meter_reading=Decimal('100.00'),
+            electricity_cost=Decimal('50.00'),
+        )
+        cls.customer = Customer.objects.create(name='Bello', phone_number='0800')
+        cls.customer_in = CustomerIn.objects.create(
+            customer_serial=1, customer=cls.customer, material_type='Nylon',
+            material_quantity=Decimal('500.00'), date=datetime.date(2024, 1, 1),
+        )
+        cls.manager = Staff.objects.create(name='Musa', phone_number='0801', role='manager')
+        cls.operator = Staff.objects.create(name='Ade', phone_number='0802', role='operator')
+        cls.packer = Staff.objects.create(name='Ngozi', phone_number='0803', role='packer')
+
+    def grant(self, *codenames):
+        self.user.user_permissions.add(*Permission.objects.filter(codename__in=codenames))
+
+    def post_operation(self, material_used='10.00', customer_in=None):
+        customer_in = customer_in or self.customer_in
+        return self.client.post(reverse('create-recycling'), {
+            'meter_ID': self.electricity.pk, 'customer_serial': customer_in.pk, 'material_used': material_used,
+            'bangori': '1.00', 'rate': '20.00', 'manager': self.manager.pk, 'operator': self.operator.pk,
+            'packer': self.packer.pk,
+        })
+
+
+class RecyclingCreateViewTests(RecyclingTestCase):
+    def test_operation_accrues_salaries_and_payable(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.post_operation('5.00')
+
+        self.assertEqual(RecyclingOperation.objects.count(), 2)
+        self.assertEqual(Salary.objects.get(staff=self.manager).amount1, Decimal('45.00'))
+        self.assertEqual(Salary.objects.get(staff=self.operator).amount1, Decimal('60.00'))
+        self.assertEqual(Salary.objects.get(staff=self.packer).amount1, Decimal('45.00'))
+        self.assertEqual(AccountPayable.objects.get(customer=self.customer).amount, Decimal('300.00'))
+
+    def test_query_budget(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+
+        # session and user, five form lookups plus their model validation checks, then savepoint, the salary rows
+        # looked up and raised in one UPDATE, the payable UPDATE, the INSERT, the intake rollup UPDATE and release
+        with self.assertNumQueries(19):
+            response = self.post_operation()
+        self.assertEqual(response.status_code, 302)
+
+    def test_batch_posts_rows_and_accrues_once_per_staff_member(self):
+        self.client.force_login(self.user)
+        data = {
+            'operations-TOTAL_FORMS': '3', 'operations-INITIAL_FORMS': '0',
+            'operations-MIN_NUM_FORMS': '0', 'operations-MAX_NUM_FORMS': '1000',
+            'operations-2-bangori': '0.0',
+        }
+        for index, material_used in enumerate(['10.00', '5.00']):
+            data.update({
+                f'operations-{index}-meter_ID': self.electricity.pk,
+                f'operations-{index}-customer_serial': self.customer_in.pk,
+                f'operations-{index}-material_used': material_used, f'operations-{index}-bangori': '1.00',
+                f'operations-{index}-rate': '20.00', f'operations-{index}-manager': self.manager.pk,
+                f'operations-{index}-operator': self.operator.pk, f'operations-{index}-packer': self.packer.pk,
+            })
+
+        response = self.client.post(reverse('create-recycling-batch'), data)
+
+        self.assertRedirects(response, reverse('recycling-list'), fetch_redirect_response=False)
+        self.assertEqual(RecyclingOperation.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Salary.objects.get(staff=self.operator).amount1, Decimal('60.00'))
+        self.assertEqual(AccountPayable.objects.get(customer=self.customer).amount, Decimal('300.00'))
+
+
+class RecyclingListViewTests(RecyclingTestCase):
+    def setUp(self):
+        super().setUp()
+        admin = get_user_model().objects.create_superuser('owner', 'owner@example.com', 'password')
+        self.client.force_login(admin)
+
+    def test_operation_pages_cost_the_same_however_deep(self):
+        self.post_operation()
+        # session and user, then the page with its reading, intake and customer joined in
+        with self.assertNumQueries(3):
+            self.client.get(reverse('recycling-list'))
+
+        for _ in range(11):
+            self.post_operation()
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('recycling-list'))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('recycling-list'), {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(len(response.context['recycling']), 5)
+
+    def add_intakes(self, count):
+        last = CustomerIn.objects.aggregate(last=Max('customer_serial'))['last']
+        for serial in range(last + 1, last + count + 1):
+            intake = CustomerIn.objects.create(customer_serial=serial, customer=self.customer, material_type='Nylon',
+                                               material_quantity=Decimal('100.00'), date=datetime.date(2024, 1, 2))
+            self.post_operation(customer_in=intake)
+
+    def test_customer_metrics_page_costs_the_same_however_many_intakes(self):
+        self.post_operation()
+        # the page count, one query joining each intake to its rollup row, then the session
+        with self.assertNumQueries(3):
+            self.client.get(reverse('customerout-detail'))
+
+        self.add_intakes(5)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('customerout-detail'))
+        metrics = response.context['customer_metrics']
+        self.assertEqual([(row.total_material_used, row.percentage_lost) for row in metrics][-1:],
+                         [(Decimal('10.00'), Decimal('97.80'))])
+
+    def test_intake_pages_fetch_their_operations_in_one_query(self):
+        self.post_operation()
+        # session and user, the page count, the page of intakes, then every operation on them
+        with self.assertNumQueries(5):
+            self.client.get(reverse('customerout-list'))
+
+        self.post_operation('5.00')
+        self.add_intakes(24)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('customerout-list'))
+        with self.assertNumQueries(5):
+            self.client.get(reverse('customerout-list'), {'page': 2})
+        intake = response.context['customerout_list'][0]
+        self.assertEqual([operation.material_lost for operation in intake.customer_recycling],
+                         [Decimal('489.00'), Decimal('494.00')])
+
+
+class CustomerInRollupTests(RecyclingTestCase):
+    def assertRollup(self, material_used, bangori, amount, operation_count):
+        rollup = CustomerInRollup.objects.get(customer_in=self.customer_in)
+        self.assertEqual(
+            (rollup.material_used, rollup.bangori, rollup.material_lost, rollup.amount, rollup.operation_count),
+            (material_used, bangori, self.customer_in.material_quantity - material_used - bangori, amount,
+             operation_count),
+        )
+
+    def test_rollup_follows_inserts_corrections_and_deletes(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.post_operation('5.00')
+        self.assertRollup(Decimal('15.00'), Decimal('2.00'), Decimal('300.00'), 2)
+
+        operation = RecyclingOperation.objects.earliest('id')
+        operation.material_used = Decimal('12.00')
+        operation.calculate_fields()
+        operation.save()
+        self.assertRollup(Decimal('17.00'), Decimal('2.00'), Decimal('340.00'), 2)
+
+        operation.delete()
+        self.assertRollup(Decimal('5.00'), Decimal('1.00'), Decimal('100.00'), 1)
+
+    def test_rebuild_repairs_changes_that_bypass_the_signals(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.post_operation('5.00')
+        # A queryset delete still sends the delete signal for each row; update() sends nothing
+        RecyclingOperation.objects.filter(material_used=Decimal('10.00')).delete()
+        RecyclingOperation.objects.update(material_used=Decimal('8.00'))
+        self.assertRollup(Decimal('5.00'), Decimal('1.00'), Decimal('100.00'), 1)
+
+        call_command('rebuild_customerin_rollups', stdout=io.StringIO())
+        self.assertRollup(Decimal('8.00'), Decimal('1.00'), Decimal('100.00'), 1)
+
+    def test_detail_shows_operation_and_intake_losses(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.post_operation('5.00')
+        operation = RecyclingOperation.objects.earliest('id')
+
+        response = self.client.get(reverse('recycling-detail2', args=[operation.pk]))
+        self.assertEqual(response.context['material_lost'], Decimal('489.00'))
+        self.assertEqual(response.context['intake_material_lost'], Decimal('483.00'))
+
+
+class MeterReadingTests(OperationsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('clerk', 'clerk@example.com', 'password')
+        ElectricityConfiguration.objects.create(fixed_cost_per_unit=Decimal('2.00'))
+
+    def capture(self, meter_ID, date, shift, meter_reading):
+        return record_meter_reading(Electricity(
+            user=self.user, meter_ID=meter_ID, date=date, shift=shift, meter_reading=Decimal(meter_reading),
+        ))
+
+    def test_readings_chain_per_meter_and_by_date(self):
+        day = datetime.date(2024, 1, 1)
+        self.capture('M1', day, 1, '100.00')
+        self.capture('M2', day, 1, '500.00')
+        night = self.capture('M1', day, 2, '130.00')
+        backdated = self.capture('M1', day - datetime.timedelta(days=1), 2, '90.00')
+        later = self.capture('M1', day + datetime.timedelta(days=1), 1, '150.00')
+
+        self.assertEqual(night.electricity_consumption, Decimal('30.00'))
+        self.assertEqual(night.electricity_cost, Decimal('60.00'))
+        self.assertEqual(backdated.electricity_consumption, Decimal('0.00'))
+        self.assertEqual(later.previous_meter_reading, Decimal('130.00'))
+        self.assertEqual(MeterHead.objects.get(meter_ID='M1').latest, later)
+
+    def test_back_dated_reading_reprices_the_one_after_it(self):
+        day, next_day = datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)
+        self.capture('M1', day, 1, '100.00')
+        self.capture('M1', day, 2, '130.00')
+        last = self.capture('M1', next_day, 2, '150.00')
+
+        # The next day's morning reading is captured after the night one
+        missed = self.capture('M1', next_day, 1, '140.00')
+
+        last.refresh_from_db()
+        self.assertEqual((missed.previous_meter_reading, missed.electricity_consumption),
+                         (Decimal('130.00'), Decimal('10.00')))
+        self.assertEqual((last.previous_meter_reading, last.electricity_consumption, last.electricity_cost),
+                         (Decimal('140.00'), Decimal('10.00'), Decimal('20.00')))
+        total = Electricity.objects.filter(meter_ID='M1').aggregate(total=Sum('electricity_consumption'))['total']
+        self.assertEqual(total, Decimal('50.00'))
+        self.assertEqual(MeterHead.objects.get(meter_ID='M1').latest, last)
+
+    def test_back_dated_reading_with_nothing_after_it_recomputes_the_head(self):
+        day = datetime.date(2024, 1, 1)
+        self.capture('M1', day, 1, '100.00')
+        moved = self.capture('M1', day + datetime.timedelta(days=1), 1, '120.00')
+        # The head's reading is corrected to another meter behind its back
+        Electricity.objects.filter(pk=moved.pk).update(meter_ID='M2')
+
+        night = self.capture('M1', day, 2, '110.00')
+
+        self.assertEqual((night.previous_meter_reading, night.electricity_consumption),
+                         (Decimal('100.00'), Decimal('10.00')))
+        self.assertEqual(MeterHead.objects.get(meter_ID='M1').latest, night)
+
+    def test_cost_uses_tariff_in_force_and_reprices(self):
+        day = datetime.date(2024, 1, 1)
+        ElectricityTariff.objects.create(effective_from=day + datetime.timedelta(days=1), cost_per_unit=Decimal('3.00'))
+        self.capture('M1', day, 1, '100.00')
+        before = self.capture('M1', day, 2, '110.00')
+        after = self.capture('M1', day + datetime.timedelta(days=1), 1, '120.00')
+        self.assertEqual((before.electricity_cost, after.electricity_cost), (Decimal('20.00'), Decimal('30.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ElectricityTariff.objects.create(effective_from=day, cost_per_unit=Decimal('5.00'))
+        with mock.patch.object(ElectricityTariff, 'schedule', side_effect=ElectricityTariff.schedule) as schedule:
+            call_command('reprice_electricity', '2024-01-01', '2024-01-31', stdout=io.StringIO())
+        # Once for the only chunk, not once per reading
+        self.assertEqual(schedule.call_count, 1)
+        before.refresh_from_db()
+        after.refresh_from_db()
+        self.assertEqual((before.electricity_cost, after.electricity_cost), (Decimal('50.00'), Decimal('30.00')))
+
+    def test_list_shows_the_rate_each_reading_was_priced_at(self):
+        day = datetime.date(2024, 1, 1)
+        ElectricityTariff.objects.create(effective_from=day - datetime.timedelta(days=1), cost_per_unit=Decimal('2.50'))
+        self.capture('M1', day, 1, '100.00')
+        self.capture('M1', day, 2, '110.00')
+        ElectricityTariff.objects.create(effective_from=day, cost_per_unit=Decimal('5.00'))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('electricity-list'))
+        self.assertEqual([reading.applied_rate for reading in response.context['electricity_details']],
+                         [Decimal('2.50'), None])
+
+    def test_list_costs_the_same_however_many_readings_and_operations(self):
+        day = datetime.date(2024, 1, 1)
+        self.capture('M1', day, 1, '100.00')
+        self.client.force_login(self.user)
+        # session and user, the page count, then the page with its operation totals as subqueries
+        with self.assertNumQueries(4):
+            self.client.get(reverse('electricity-list'))
+
+        customer = Customer.objects.create(name='Bello', phone_number='0800')
+        customer_in = CustomerIn.objects.create(customer_serial=1, customer=customer, material_type='Nylon',
+                                                material_quantity=Decimal('500.00'), date=day)
+        staff = Staff.objects.create(name='Musa', phone_number='0801', role='manager')
+        for index in range(1, 30):
+            reading = self.capture('M1', day + datetime.timedelta(days=index), 1, f'{100 + index * 10}.00')
+            RecyclingOperation.objects.create(
+                user=self.user, meter_ID=reading, customer_serial=customer_in, material_used=Decimal('10.00'),
+                bangori=Decimal('1.00'), rate=Decimal('20.00'), manager=staff, operator=staff, packer=staff,
+            )
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('electricity-list'))
+        self.assertEqual(response.context['electricity_details'][0].total_material_used, Decimal('10.00'))
+        with self.assertNumQueries(4):
+            self.client.get(reverse('electricity-list'), {'page': 2})
+
+
+class SalaryListViewTests(RecyclingTestCase):
+    def test_lists_every_role_with_totals_in_fixed_queries(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+
+        # session and user, page COUNT, page rows and the totals
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('salary-list'))
+        self.assertEqual(
+            [(salary.staff.role, salary.staff.name, salary.amount1) for salary in response.context['salaries']],
+            [('manager', 'Musa', Decimal('30.00')), ('operator', 'Ade', Decimal('40.00')),
+             ('packer', 'Ngozi', Decimal('30.00'))],
+        )
+        self.assertEqual(response.context['total_operator_salary'], Decimal('40.00'))
+
+
+class PayrollCloseTests(RecyclingTestCase):
+    def test_close_writes_statements_and_is_idempotent(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.post_operation('5.00')
+
+        day = self.electricity.date
+        close_payroll_period(day, day)
+        period, statements = close_payroll_period(day, day)
+
+        self.assertEqual(PayrollStatement.objects.count(), 3)
+        self.assertEqual(
+            sorted((statement.role, statement.material_used, statement.operation_count, statement.earnings)
+                   for statement in statements),
+            [('manager', Decimal('15.00'), 2, Decimal('45.00')), ('operator', Decimal('15.00'), 2, Decimal('60.00')),
+             ('packer', Decimal('15.00'), 2, Decimal('45.00'))],
+        )
+        self.assertEqual(Salary.objects.get(staff=self.operator).amount1, Decimal('60.00'))
+        with self.assertRaises(ValueError):
+            statements[0].save()
+
+    def test_closing_again_after_a_correction_keeps_manual_balances(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.post_operation('5.00')
+        Salary.objects.filter(staff=self.operator).update(amount1=F('amount1') + Decimal('70.00'))  # entered by hand
+        idle = Staff.objects.create(name='Femi', phone_number='0805', role='packer')
+        Salary.objects.create(staff=idle, amount1=Decimal('70.00'))  # carried over from before the ledger
+
+        day = self.electricity.date
+        close_payroll_period(day, day)
+        self.assertEqual(Salary.objects.get(staff=self.operator).amount1, Decimal('130.00'))
+
+        # The second operation really used 8.00; only the 3.00 difference reaches the accruals
+        RecyclingOperation.objects.filter(material_used=Decimal('5.00')).update(material_used=Decimal('8.00'))
+        close_payroll_period(day, day)
+        close_payroll_period(day, day)
+
+        self.assertEqual(Salary.objects.get(staff=self.operator).amount1, Decimal('142.00'))
+        self.assertEqual(Salary.objects.get(staff=self.manager).amount1, Decimal('54.00'))
+        self.assertEqual(Salary.objects.get(staff=idle).amount1, Decimal('70.00'))
+
+    def test_overlapping_period_is_refused(self):
+        day = self.electricity.date
+        close_payroll_period(day, day + datetime.timedelta(days=6))
+
+        with self.assertRaises(OverlappingPayrollPeriod):
+            close_payroll_period(day + datetime.timedelta(days=3), day + datetime.timedelta(days=9))
+        with self.assertRaisesMessage(CommandError, 'overlaps'):
+            call_command('close_payroll_period', str(day - datetime.timedelta(days=1)), str(day),
+                         stdout=io.StringIO())
+        self.assertEqual(PayrollPeriod.objects.count(), 1)
+
+
+class SalaryDisbursementTests(RecyclingTestCase):
+    def test_requires_the_salary_payment_permission(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(reverse('salary-pay-all'), {'description': 'Payday'}).status_code, 403)
+
+    def test_pays_every_accrual_with_one_ledger_debit(self):
+        GeneralExpensesAccount.objects.create(balance=Decimal('1000.00'))
+        self.grant('add_salarypayment')
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.assertEqual(self.client.get(reverse('salary-pay-all')).context['total_outstanding'], Decimal('100.00'))
+
+        response = self.client.post(reverse('salary-pay-all'), {'description': 'January salaries'})
+
+        self.assertRedirects(response, reverse('salary-list'), fetch_redirect_response=False)
+        self.assertEqual(Transaction.objects.get().amount, Decimal('100.00'))
+        self.assertEqual(GeneralExpensesAccount.objects.get().balance, Decimal('900.00'))
+        self.assertEqual(SalaryPayment.objects.get(staff=self.operator).amount1, Decimal('40.00'))
+        self.assertFalse(Salary.objects.filter(amount1__gt=0).exists())
+
+    def test_insufficient_balance_pays_nobody(self):
+        GeneralExpensesAccount.objects.create(balance=Decimal('10.00'))
+        self.grant('add_salarypayment')
+        self.client.force_login(self.user)
+        self.post_operation()
+
+        response = self.client.post(reverse('salary-pay-all'), {'description': 'January salaries'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SalaryPayment.objects.exists())
+        self.assertEqual(Salary.objects.get(staff=self.operator).amount1, Decimal('40.00'))
+
+
+class SalaryPaymentCreateTests(RecyclingTestCase):
+    def test_pays_one_staff_member_with_permission_only(self):
+        GeneralExpensesAccount.objects.create(balance=Decimal('1000.00'))
+        self.client.force_login(self.user)
+        self.post_operation()
+        data = {'staff': self.operator.pk, 'amount1': '40.00', 'description': 'January'}
+        self.assertEqual(self.client.post(reverse('operator-salary-create'), data).status_code, 403)
+
+        self.grant('add_salarypayment')
+        response = self.client.post(reverse('operator-salary-create'), data)
+
+        self.assertRedirects(response, reverse('salary-list'), fetch_redirect_response=False)
+        self.assertEqual(Salary.objects.get(staff=self.operator).amount1, Decimal('0.00'))
+        self.assertEqual(GeneralExpensesAccount.objects.get().balance, Decimal('960.00'))
+
+
+class PayablesAgingTests(RecyclingTestCase):
+    def test_buckets_charges_by_age_and_settles_oldest_first(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.post_operation('5.00')
+        old, new = RecyclingOperation.objects.order_by('id')
+        RecyclingOperation.objects.filter(pk=old.pk).update(created_at=timezone.now() - datetime.timedelta(days=75))
+
+        [row] = payables_aging()
+        self.assertEqual((row.current, row.days_61_90, row.balance),
+                         (Decimal('100.00'), Decimal('200.00'), Decimal('300.00')))
+        # Kept in this worker
+        with self.assertNumQueries(0):
+            payables_aging()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_payment(Payment(customer=self.customer, amount=Decimal('250.00'), description='Part payment'))
+        [row] = payables_aging()
+        self.assertEqual((row.current, row.days_61_90, row.balance),
+                         (Decimal('50.00'), Decimal('0.00'), Decimal('50.00')))
+
+    def test_moving_an_intake_to_another_customer_refreshes_the_report(self):
+        self.client.force_login(self.user)
+        self.post_operation()
+        self.assertEqual([row.name for row in payables_aging()], ['Bello'])
+
+        self.customer_in.customer = Customer.objects.create(name='Chidi', phone_number='0804')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer_in.save()
+        self.assertEqual([(row.name, row.balance) for row in payables_aging()], [('Chidi', Decimal('200.00'))])
+
+
+class CustomerStatementTests(RecyclingTestCase):
+    def test_pages_and_export_carry_the_running_balance(self):
+        admin = get_user_model().objects.create_superuser('owner', 'owner@example.com', 'password')
+        self.client.force_login(admin)
+        for index in range(3):
+            self.post_operation()
+            record_payment(Payment(customer=self.customer, amount=Decimal('50.00'), description=f'Payment {index}'))
+
+        first = self.client.get(reverse('customer-statement', args=[self.customer.pk]))
+        rows, next_cursor = first.context['statement'], first.context['next_cursor']
+        self.assertEqual([row.balance for row in rows], [Decimal('200.00'), Decimal('150.00'), Decimal('350.00'),
+                                                        Decimal('300.00'), Decimal('500.00'), Decimal('450.00')])
+        self.assertIsNone(next_cursor)
+
+        rows, opening_balance, next_cursor = customer_statement(self.customer, per_page=4)
+        rows, opening_balance, _ = customer_statement(self.customer, next_cursor, per_page=4)
+        self.assertEqual((opening_balance, [row.balance for row in rows]),
+                         (Decimal('300.00'), [Decimal('500.00'), Decimal('450.00')]))
+
+        response = self.client.get(reverse('customer-statement-export', args=[self.customer.pk]))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertTrue(lines[-1].endswith(',450.00'))
+
+
+class PelletsProfitabilityTests(OperationsTestCase):
+    def test_groups_sales_by_month_and_flakes_type(self):
+        processing = FlakesCost.objects.create(cost_id='C1', cost_of_washing=Decimal('10.00'),
+                                               cost_of_transport=Decimal('5.00'), pelleting_cost=Decimal('5.00'),
+                                               other_cost=Decimal('0.00'), total_cost2=Decimal('20.00'))
+        for serial, flakes_type, month in (('F1', 'PET', 1), ('F2', 'PET', 1), ('F3', 'HDPE', 2)):
+            flakes = FlakesIn.objects.create(serial=serial, date=datetime.date(2024, month, 1), flakes_type=flakes_type,
+                                             flakes_quantity=Decimal('100.00'), unit_cost=Decimal('1.00'),
+                                             total_cost1=Decimal('100.00'))
+            PelletsPrice.objects.create(date=datetime.date(2024, month, 15), serial=flakes, cost_id=processing,
+                                        pellets_quantity=Decimal('80.00'), unit_price=Decimal('2.00'),
+                                        price=Decimal('160.00'), profit=Decimal('40.00'))
+
+        rows = pellets_profitability(2024)
+        self.assertEqual(
+            [(row.month.month, row.flakes_type, row.sales, row.profit, row.margin, row.pellet_yield) for row in rows],
+            [(1, 'PET', 2, Decimal('80.00'), Decimal('25.00'), Decimal('80.00')),
+             (2, 'HDPE', 1, Decimal('40.00'), Decimal('25.00'), Decimal('80.00'))],
+        )
+        with self.assertNumQueries(0):
+            pellets_profitability(2024)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PelletsPrice.objects.filter(profit=Decimal('40.00')).first().delete()
+        self.assertEqual([(row.month.month, row.sales) for row in pellets_profitability(2024)], [(1, 1), (2, 1)])
+
+
+class SerialAllocatorTests(RecyclingTestCase):
+    def setUp(self):
+        super().setUp()
+        serials._blocks.clear()
+        self.client.force_login(self.user)
+
+    def test_intakes_get_serials_from_a_reserved_block(self):
+        data = {'customer': self.customer.pk, 'material_type': 'Nylon', 'material_quantity': '10.00',
+                'date': '2024-01-01'}
+        self.client.post(reverse('create-customerin'), data)
+        self.assertEqual(SerialSequence.objects.get(name='customer_in').next_value, 2 + serials.BLOCK_SIZE)
+
+        # The rest of the block is handed out without touching the sequence table
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('create-customerin'), data)
+        self.assertFalse([query for query in queries if 'operations_serialsequence' in query['sql']])
+        self.assertEqual(list(CustomerIn.objects.order_by('pk').values_list('customer_serial', flat=True)), [1, 2, 3])
+
+    def test_taken_serial_is_skipped(self):
+        FlakesIn.objects.create(serial='FL000001', date=datetime.date(2024, 1, 1), flakes_type='PET',
+                                flakes_quantity=Decimal('1.00'), unit_cost=Decimal('1.00'))
+        SerialSequence.objects.create(name='flakes_in', next_value=1)
+        data = {'date': '2024-01-01', 'flakes_type': 'PET', 'flakes_quantity': '10.00', 'unit_cost': '2.00'}
+
+        self.assertEqual(self.client.post(reverse('create-flakes_in'), data).status_code, 302)
+        flakes = FlakesIn.objects.latest('pk')
+        self.assertEqual((flakes.serial, flakes.total_cost1), ('FL000002', Decimal('20.00')))
+
+    def test_serial_urls_still_resolve(self):
+        self.assertEqual(reverse('recycling-detail2', args=[self.customer_in.customer_serial]), '/recycling/1/')
@@ -13,17 +13,19 @@ from .views import (HomePageView,
                     PayableListView,
                     PaymentCreateView,
                     SalaryListView,
-                    ManagerSalaryCreateView, CreditAccountView, TransactionListView, CustomerInCreateView,
-                    CustomerOutView, OperatorSalaryCreateView,
-                    PackerSalaryCreateView, CustomLoginView, ElectricityCreateView, ElectricityListView,
+                    SalaryPaymentCreateView, CreditAccountView, TransactionListView, CustomerInCreateView,
+                    CustomerOutView, CustomLoginView, ElectricityCreateView, ElectricityListView,
                     CustomerMetricsView, PelletsPriceListView, FlakesCostCreateView, FlakesInCreateView,
-                    PelletsPriceCreateView, FlakesInListView,
+                    PelletsPriceCreateView, FlakesInListView, BalanceAsOfView,
+                    LedgerImportView, LedgerExportView, RecyclingBatchCreateView, SalaryDisbursementView,
+                    CustomerStatementView, CustomerStatementExportView, PelletsProfitabilityView,
                     )
 
 register_converter(DecimalConverter, 'decimal')
 
 urlpatterns = [
     path('flakes/pellets-list/', PelletsPriceListView.as_view(), name='pellets-list'),
+    path('flakes/pellets-profitability/', PelletsProfitabilityView.as_view(), name='pellets-profitability'),
     path('flakes/flakes-list/', FlakesInListView.as_view(), name='flakes-list'),
     path('flakes/create-flakes_cost/', FlakesCostCreateView.as_view(), name='create-flakes_cost'),
     path('flakes/create-flakes_in/', FlakesInCreateView.as_view(), name='create-flakes_in'),
@@ -33,18 +35,29 @@ urlpatterns = [
     path('recycling/<decimal:pk>/', RecyclingDetailView.as_view(), name='recycling-detail2'),
     path('recycling/createcustomerin/', CustomerInCreateView.as_view(), name='create-customerin'),
     path('expenses/transaction-list/', TransactionListView.as_view(), name='transaction-list'),
+    path('expenses/balance-as-of/', BalanceAsOfView.as_view(), name='balance-as-of'),
+    path('expenses/import-ledger/', LedgerImportView.as_view(), name='import-ledger'),
+    path('expenses/export-ledger/', LedgerExportView.as_view(), name='export-ledger'),
     path('expenses/credit_debit-account/', CreditAccountView.as_view(), name='credit_debit-account'),
-    path('salary/create_manager_salary/', ManagerSalaryCreateView.as_view(), name='manager-salary-create'),
-    path('salary/create_operator_salary/', OperatorSalaryCreateView.as_view(), name='operator-salary-create'),
-    path('salary/create_packer_salary/', PackerSalaryCreateView.as_view(), name='packer-salary-create'),
+    path('salary/create_salary/', SalaryPaymentCreateView.as_view(), name='salary-payment-create'),
+    path('salary/create_manager_salary/', SalaryPaymentCreateView.as_view(role='manager'),
+         name='manager-salary-create'),
+    path('salary/create_operator_salary/', SalaryPaymentCreateView.as_view(role='operator'),
+         name='operator-salary-create'),
+    path('salary/create_packer_salary/', SalaryPaymentCreateView.as_view(role='packer'), name='packer-salary-create'),
+    path('salary/pay-all/', SalaryDisbursementView.as_view(), name='salary-pay-all'),
     path('salary/', SalaryListView.as_view(), name='salary-list'),
     path('payable/', PayableListView.as_view(), name='payable-list'),
     path('recycling/create/', RecyclingCreateView.as_view(), name='create-recycling'),
+    path('recycling/create-batch/', RecyclingBatchCreateView.as_view(), name='create-recycling-batch'),
     path('electricity/create/', ElectricityCreateView.as_view(), name='create-electricity'),
     path('electricity/electricity-list/', ElectricityListView.as_view(), name='electricity-list'),
     path('recycling/', RecyclingListView.as_view(), name='recycling-list'),
     path('expenses/create/', ExpenseCreateView.as_view(), name='create-expense'),
     path('payable/create/', PaymentCreateView.as_view(), name='create-payment'),
+    path('payable/customer/<int:pk>/statement/', CustomerStatementView.as_view(), name='customer-statement'),
+    path('payable/customer/<int:pk>/statement/export/', CustomerStatementExportView.as_view(),
+         name='customer-statement-export'),
     path('expenses/<int:pk>/', ExpenseDetailView.as_view(), name='expense-detail'),
     path('payable/<int:pk>/', ExpenseDetailView.as_view(), name='payment-detail'),
     path('payable/', PayableListView.as_view(), name='payment-list'),
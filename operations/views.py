@@ -1,21 +1,35 @@
+import csv
+import datetime
+import io
+
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.views import View
 from django.views.generic import TemplateView, ListView, DetailView
 from django import forms
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.core.paginator import Paginator
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Value
+from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Value, Prefetch, OuterRef, Subquery
 from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.db.models.functions import Coalesce
-from django.views.generic.edit import CreateView, UpdateView
-from .models import (Expense, RecyclingOperation, ElectricityConfiguration, AccountPayable, Payment,
-                     GeneralExpensesAccount, Manager, Operator, Packer, SalaryManager, SalaryPacker, SalaryOperator,
-                     ManagerSalaryPayment, Transaction, CustomerIn, OperatorSalaryPayment, PackerSalaryPayment,
-                     InitialMeterReading, Electricity, FlakesIn, FlakesCost, PelletsPrice, )
+from django.views.generic.edit import CreateView, UpdateView, FormView
+from .models import (Customer, Expense, RecyclingOperation,
+                     Payment, GeneralExpensesAccount, Staff, Salary, SalaryPayment, Transaction,
+                     CustomerIn, Electricity, FlakesIn, FlakesCost, PelletsPrice,
+                     CustomerInRollup, STAFF_ROLES, )
+from .exports import streaming_export
+from .forms import (BalanceAsOfForm, DateRangeForm, ElectricityFilterForm, ExportForm, LedgerExportForm,
+                    LedgerImportForm, PelletsReportForm, RecyclingOperationFormSet, SalaryDisbursementForm)
+from .importers import LedgerImportError, import_ledger, read_ledger_rows, validate_ledger
+from .pagination import paginate_keyset
+from .reports import (customer_statement, iter_customer_statement, payables_aging, pellets_profitability,
+                      profitability_totals)
+from .serials import next_customer_serial, next_flakes_serial, save_with_serial
+from .services import (InsufficientBalance, accrue, pay_outstanding_salaries, post_recycling_operation,
+                       post_recycling_operations, post_transaction, record_meter_reading, record_payment)
 from decimal import Decimal
 from allauth.account.views import LoginView
 
@@ -43,22 +57,14 @@ class ExpenseCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         expense_amount = form.cleaned_data['amount']
 
-        general_expenses_account = GeneralExpensesAccount.objects.first()
-        if general_expenses_account.balance >= expense_amount:
-            # Create a debit transaction
-            Transaction.objects.create(
-                account=general_expenses_account,
-                amount=expense_amount,
-                description=form.cleaned_data['description'],
-                transaction_type='debit',  # Set the transaction type
-            )
-
-            general_expenses_account.balance -= expense_amount
-            general_expenses_account.save()
+        try:
+            with transaction.atomic():
+                # Debit the account and record the expense together, or not at all
+                post_transaction(expense_amount, 'debit', form.cleaned_data['description'])
 
-            form.instance.user = self.request.user
-            return super().form_valid(form)
-        else:
+                form.instance.user = self.request.user
+                return super().form_valid(form)
+        except InsufficientBalance:
             return HttpResponseBadRequest("Insufficient balance to cover the expense.")
 
 
@@ -80,45 +86,148 @@ class ExpenseListView(LoginRequiredMixin, ListView):
 class TransactionListView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
     permission_required = 'expenses.view_transaction'
     template_name = 'expenses/transaction-list.html'
+    paginate_by = 50
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         general_expenses_account = GeneralExpensesAccount.objects.first()
+        transactions = Transaction.objects.filter(account=general_expenses_account)
+
+        # Keyset pagination: each page is an index range scan instead of an ever-growing OFFSET
+        page = paginate_keyset(
+            transactions.with_running_balance(),
+            ('created_at', 'id'),
+            self.paginate_by,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+        )
 
-        transactions = Transaction.objects.filter(account=general_expenses_account).order_by('created_at')
+        # The window sum restarts at the first row of the page, so add the balance brought forward
+        if page.object_list:
+            first = page.object_list[0]
+            opening_balance = general_expenses_account.balance_before(first.created_at, first.pk)
+            for row in page:
+                row.running_balance += opening_balance
 
-        transaction_details = []
+        context['transaction_details'] = page
+        context['page_obj'] = page
+        return context
 
-        balance = 0  # Initialize the balance
 
-        for transaction in transactions:
-            if transaction.transaction_type == 'debit':
-                debit_amount = transaction.amount
-                credit_amount = None
-            else:
-                debit_amount = None
-                credit_amount = transaction.amount
+class BalanceAsOfView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+    permission_required = 'expenses.view_transaction'
+    template_name = 'expenses/balance-as-of.html'
 
-            # Update the balance based on the transaction type
-            if debit_amount:
-                balance -= debit_amount
-            else:
-                balance += credit_amount
-
-            transaction_detail = {
-                'date': transaction.created_at,
-                'description': transaction.description,
-                'debit_amount': debit_amount,
-                'credit_amount': credit_amount,
-                'balance': balance,
-            }
-            transaction_details.append(transaction_detail)
-
-        context['transaction_details'] = transaction_details
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = BalanceAsOfForm(self.request.GET or None)
+        context['form'] = form
+
+        if form.is_valid():
+            general_expenses_account = GeneralExpensesAccount.objects.first()
+            as_of = form.cleaned_data['date']
+            day_start = timezone.make_aware(datetime.datetime.combine(as_of, datetime.time.min))
+
+            # Opening balance comes from the nearest checkpoint; the day's postings are the only rows read
+            opening_balance = general_expenses_account.balance_before(day_start)
+            transactions = list(
+                Transaction.objects.filter(account=general_expenses_account, created_at__gte=day_start,
+                                           created_at__lt=day_start + datetime.timedelta(days=1))
+                .with_running_balance().order_by('created_at', 'id')
+            )
+            for row in transactions:
+                row.running_balance += opening_balance
+
+            context['as_of'] = as_of
+            context['opening_balance'] = opening_balance
+            context['closing_balance'] = transactions[-1].running_balance if transactions else opening_balance
+            context['transaction_details'] = transactions
         return context
 
 
+class LedgerExportView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    permission_required = 'expenses.view_transaction'
+    chunk_size = 2000
+
+    def get(self, request):
+        form = LedgerExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+
+        general_expenses_account = GeneralExpensesAccount.objects.first()
+        transactions = Transaction.objects.filter(account=general_expenses_account)
+        opening_balance = Decimal('0.00')
+
+        start, end = form.cleaned_data['start'], form.cleaned_data['end']
+        if start:
+            start = timezone.make_aware(datetime.datetime.combine(start, datetime.time.min))
+            opening_balance = general_expenses_account.balance_before(start)
+            transactions = transactions.filter(created_at__gte=start)
+        if end:
+            end = timezone.make_aware(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min))
+            transactions = transactions.filter(created_at__lt=end)
+
+        ledger = (transactions.with_running_balance().order_by('created_at', 'id')
+                  .values_list('created_at', 'description', 'transaction_type', 'amount', 'running_balance')
+                  .iterator(chunk_size=self.chunk_size))
+        rows = (
+            (created_at, description, transaction_type, amount, opening_balance + running_balance)
+            for created_at, description, transaction_type, amount, running_balance in ledger
+        )
+        return streaming_export(
+            'expense-ledger',
+            form.cleaned_data['file_format'] or 'csv',
+            ['date', 'description', 'transaction_type', 'amount', 'balance'],
+            rows,
+            compress=form.cleaned_data['compress'],
+        )
+
+
+class LedgerImportView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
+    permission_required = 'operations.add_transaction'
+    template_name = 'expenses/import-ledger.html'
+    form_class = LedgerImportForm
+    chunk_size = 1000
+
+    def form_valid(self, form):
+        file_format = form.cleaned_data['file_format']
+        general_expenses_account = GeneralExpensesAccount.objects.first()
+        stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8', newline='')
+
+        # Validate the whole upload before writing anything
+        try:
+            rows, batches, closing_balance = validate_ledger(
+                read_ledger_rows(stream, file_format), self.chunk_size, general_expenses_account.balance
+            )
+        except LedgerImportError as exc:
+            for error in exc.errors[:20]:
+                form.add_error('file', error)
+            return self.form_invalid(form)
+        except (UnicodeDecodeError, csv.Error):
+            form.add_error('file', 'The file could not be read as UTF-8 CSV or JSON Lines')
+            return self.form_invalid(form)
+
+        imported = 0
+        if not form.cleaned_data['dry_run']:
+            stream.seek(0)
+            try:
+                imported = import_ledger(read_ledger_rows(stream, file_format), self.chunk_size,
+                                         general_expenses_account)
+            except LedgerImportError as exc:
+                # The balance moved between validation and import; nothing was written
+                for error in exc.errors:
+                    form.add_error('file', error)
+                return self.form_invalid(form)
+            except IntegrityError:
+                form.add_error('file', 'The import was rolled back by the database and nothing was written')
+                return self.form_invalid(form)
+
+        return self.render_to_response(self.get_context_data(
+            form=form, rows=rows, batches=batches, closing_balance=closing_balance, imported=imported,
+        ))
+
+
 class ExpenseDetailView(LoginRequiredMixin, DetailView):
     model = Expense
     template_name = 'expenses/expense-detail.html'
@@ -137,59 +246,63 @@ class CreditAccountView(LoginRequiredMixin, PermissionRequiredMixin, CreateView)
         description = form.cleaned_data['description']
         transaction_type = form.cleaned_data['transaction_type']
 
-        # Get the GeneralExpensesAccount
-        general_expenses_account = GeneralExpensesAccount.objects.first()
-
-        # Create a transaction and set the account field
-        transaction = form.save(commit=False)
-        transaction.account = general_expenses_account
-        transaction.amount = amount
-        transaction.description = description
-        transaction.transaction_type = transaction_type
-        transaction.save()
-
-        if transaction_type == 'credit':
-            # Credit the GeneralExpensesAccount
-            general_expenses_account.credit(amount, description)
-        elif transaction_type == 'debit':
-            # Debit the GeneralExpensesAccount
-            general_expenses_account.debit(amount, description)
+        # Post the transaction and move the GeneralExpensesAccount balance in one step
+        try:
+            self.object = post_transaction(amount, transaction_type, description)
+        except InsufficientBalance:
+            return HttpResponseBadRequest("Insufficient balance to cover the debit.")
 
         # Return the account balance template as a response
         return redirect(self.success_url)
 
 
-class ElectricityListView(TemplateView):
+class ElectricityListView(LoginRequiredMixin, ListView):
+    model = Electricity
     template_name = 'electricity/electricity-list.html'
+    context_object_name = 'electricity_details'
+    paginate_by = 25
+
+    def get_queryset(self):
+        readings = Electricity.objects.all()
+        self.filter_form = ElectricityFilterForm(self.request.GET or None)
+        if self.filter_form.is_valid():
+            for field in ('date', 'shift', 'meter_ID'):
+                value = self.filter_form.cleaned_data[field]
+                if value not in (None, ''):
+                    readings = readings.filter(**{field: value})
+
+        # Per-reading totals as correlated subqueries: evaluated for the page rows only, and left out of COUNT(*)
+        decimal = DecimalField(max_digits=12, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=decimal)
+
+        def operations_total(field):
+            return Coalesce(Subquery(
+                RecyclingOperation.objects.filter(meter_ID=OuterRef('pk')).order_by()
+                .values('meter_ID').annotate(total=Sum(field)).values('total'),
+                output_field=decimal,
+            ), zero)
+
+        return readings.annotate(
+            total_material_used=operations_total('material_used'),
+            total_bangori=operations_total('bangori'),
+            total_standard_electricity_cost=operations_total('standard_electricity_cost'),
+        ).annotate(
+            consumption=Coalesce(F('meter_reading') - F('previous_meter_reading'), zero, output_field=decimal),
+            variance=Coalesce(F('total_standard_electricity_cost') - F('electricity_cost'), zero,
+                              output_field=decimal),
+        ).order_by('-date', '-shift', '-id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-
-        # Aggregate related RecyclingOperation instances based on meter_ID
-        electricity_instances = Electricity.objects.annotate(
-            total_material_used=Sum('recyclingoperation__material_used'),
-            total_bangori=Sum('recyclingoperation__bangori'),
-            total_standard_electricity_cost=Sum('recyclingoperation__standard_electricity_cost'),
-        )
-
-        # Calculate derived fields for Electricity Consumption, Electricity Cost, and Electricity Variance
-        for instance in electricity_instances:
-            instance.electricity_consumption = (
-                instance.meter_reading - instance.previous_meter_reading
-                if instance.previous_meter_reading is not None
-                else 0
-            )
-
-            # Calculate Electricity Cost based on your logic (you can add the calculation here)
-
-            # Calculate Electricity Variance
-            instance.electricity_variance = (
-                instance.total_standard_electricity_cost - instance.electricity_cost
-                if instance.total_standard_electricity_cost is not None
-                else 0
-            )
-
-        context['electricity_details'] = electricity_instances
+        # The rate each reading was priced at, which stays put when the tariff schedule changes later; worked out
+        # in Python for the page rows as SQLite divides whole-valued decimals as integers
+        for reading in context['electricity_details']:
+            reading.applied_rate = None
+            if reading.electricity_consumption:
+                reading.applied_rate = reading.electricity_cost / reading.electricity_consumption
+        context['filter_form'] = self.filter_form
+        context['query_string'] = self.request.GET.copy()
+        context['query_string'].pop('page', None)
         return context
 
 
@@ -202,29 +315,9 @@ class ElectricityCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.user = self.request.user  # Assign the current logged-in user
 
-        # Get the most recent operation or initial meter reading
-        previous_operation = Electricity.objects.order_by('-id').first()
-        initial_meter_reading = InitialMeterReading.objects.first()
-
-        # Calculate previous meter reading based on the most recent operation or initial reading
-        if previous_operation:
-            form.instance.previous_meter_reading = previous_operation.meter_reading
-        elif initial_meter_reading:
-            form.instance.previous_meter_reading = initial_meter_reading.initial_reading
-        else:
-            form.instance.previous_meter_reading = form.instance.meter_reading
-
-        # Calculate electricity consumption considering initial meter reading
-        form.instance.electricity_consumption = (
-                form.instance.meter_reading - form.instance.previous_meter_reading
-        )
-
-        # Calculate electricity cost
-        form.instance.electricity_cost = (
-                form.instance.electricity_consumption * ElectricityConfiguration.objects.first().fixed_cost_per_unit
-        )
-
-        return super().form_valid(form)
+        # Previous reading, consumption and cost are worked out per meter, under that meter's lock
+        self.object = record_meter_reading(form.instance)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class RecyclingCreateView(CreateView):
@@ -237,11 +330,9 @@ class RecyclingCreateView(CreateView):
 
         if self.is_valid_data(form):
             self.calculate_fields(form)
-            self.update_salaries(form)
-            self.update_account_payable(form)
 
-            # Save the form and assign the object to self.object
-            self.object = form.save()
+            # Salaries, the customer's payable and the operation itself are written together
+            self.object = post_recycling_operation(form.instance)
 
         return HttpResponseRedirect(self.get_success_url())
 
@@ -251,63 +342,7 @@ class RecyclingCreateView(CreateView):
         return rate is not None and material_used is not None
 
     def calculate_fields(self, form):
-        form.instance.standard_electricity_cost = (
-                (form.instance.material_used * form.instance.rate) / Decimal('2.37')
-        )
-        form.instance.amount = form.instance.rate * form.instance.material_used
-
-        electricity_instance = form.instance.meter_ID
-        if electricity_instance:
-            electricity_cost = electricity_instance.electricity_cost or Decimal('0.00')
-            standard_electricity_cost = form.instance.standard_electricity_cost or Decimal('0.00')
-            form.instance.electricity_variance = standard_electricity_cost - electricity_cost
-        else:
-            form.instance.electricity_variance = None
-
-    def update_salaries(self, form):
-        manager = form.cleaned_data.get('manager')
-        operator = form.cleaned_data.get('operator')
-        packer = form.cleaned_data.get('packer')
-        material_used = form.instance.material_used
-
-        for role, amount_multiplier in [(manager, Decimal('3.0')), (operator, Decimal('4.0')),
-                                        (packer, Decimal('3.0'))]:
-            if role and material_used is not None:
-                try:
-                    salary_instance = {
-                        manager: SalaryManager,
-                        operator: SalaryOperator,
-                        packer: SalaryPacker
-                    }[role].objects.get_or_create(**{role.__class__.__name__.lower(): role})[0]
-                    salary_instance.amount1 += material_used * amount_multiplier
-                    salary_instance.save()
-                except (SalaryManager.DoesNotExist, SalaryOperator.DoesNotExist, SalaryPacker.DoesNotExist):
-                    pass
-
-    # Inside the update_account_payable method:
-    def update_account_payable(self, form):
-        customer_serial = form.cleaned_data.get('customer_serial')
-        due_date = form.cleaned_data.get('date')
-
-        if customer_serial:
-            customer = customer_serial.customer
-            amount = form.instance.amount  # Assuming amount is correctly calculated in the form
-
-            # Provide a default due_date if not available in the form
-            if not due_date:
-                due_date = timezone.now()  # Use the current timestamp as a default
-
-            # Create or update the AccountPayable instance for the customer
-            account_payable, created = AccountPayable.objects.get_or_create(
-                customer=customer,
-                defaults={'amount': amount, 'due_date': due_date}
-            )
-
-            # If the AccountPayable instance already exists, update the amount and due_date
-            if not created:
-                account_payable.amount += amount
-                account_payable.due_date = due_date
-                account_payable.save()
+        form.instance.calculate_fields()
 
     def get_success_url(self):
         try:
@@ -319,90 +354,120 @@ class RecyclingCreateView(CreateView):
             return reverse_lazy('error-page')
 
 
+class RecyclingBatchCreateView(LoginRequiredMixin, TemplateView):
+    template_name = 'recycling/create-recycling-batch.html'
+
+    def get_formset(self):
+        return RecyclingOperationFormSet(
+            self.request.POST or None, queryset=RecyclingOperation.objects.none(), prefix='operations',
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.setdefault('formset', self.get_formset())
+        return context
+
+    def post(self, request, *args, **kwargs):
+        formset = self.get_formset()
+        if not formset.is_valid():
+            return self.render_to_response(self.get_context_data(formset=formset))
+
+        operations = []
+        for form in formset:
+            if form.has_changed():
+                form.instance.user = request.user
+                form.instance.calculate_fields()
+                operations.append(form.instance)
+
+        # One INSERT for the shift and one accrual write per staff member and customer
+        post_recycling_operations(operations)
+        return HttpResponseRedirect(reverse_lazy('recycling-list'))
+
+
 class CustomerMetricsView(View):
     template_name = 'recycling/customerout-detail.html'
+    paginate_by = 50
 
     def get(self, request):
-        # Fetch all CustomerIn instances with their associated total material_quantity
-        customers = CustomerIn.objects.annotate(
-            total_material_quantity=Sum('material_quantity')
-        ).values('customer_serial', 'total_material_quantity')
-
-        customer_metrics = []
-        for customer in customers:
-            # Fetch total material_used, total bangori for each customer_serial in RecyclingOperation
-            total_material_used = RecyclingOperation.objects.filter(
-                customer_serial=customer['customer_serial']
-            ).aggregate(total_material_used=Sum('material_used'))['total_material_used'] or 0
-
-            total_bangori = RecyclingOperation.objects.filter(
-                customer_serial=customer['customer_serial']
-            ).aggregate(total_bangori=Sum('bangori'))['total_bangori'] or 0
-
-            # Calculate total_material_lost and percentage_lost
-            material_quantity = customer['total_material_quantity']
-            total_material_lost = material_quantity - total_material_used - total_bangori
-            percentage_lost = (total_material_lost / material_quantity) * 100
-
-            customer_metrics.append({
-                'customer_serial': customer['customer_serial'],
-                'material_quantity': material_quantity,
-                'total_material_used': total_material_used,
-                'total_bangori': total_bangori,
-                'total_material_lost': total_material_lost,
-                'percentage_lost': percentage_lost,
-            })
-
-        return render(request, self.template_name, {'customer_metrics': customer_metrics})
+        form = DateRangeForm(request.GET or None)
+        customers = CustomerIn.objects.all()
+        if form.is_valid():
+            if form.cleaned_data['start']:
+                customers = customers.filter(date__gte=form.cleaned_data['start'])
+            if form.cleaned_data['end']:
+                customers = customers.filter(date__lte=form.cleaned_data['end'])
+
+        # Totals come from each intake's rollup row, so the page is a plain one-to-one join
+        decimal = DecimalField(max_digits=12, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=decimal)
+        customer_metrics = customers.annotate(
+            total_material_used=Coalesce(F('rollup__material_used'), zero),
+            total_bangori=Coalesce(F('rollup__bangori'), zero),
+            total_material_lost=Coalesce(F('rollup__material_lost'), F('material_quantity')),
+        ).order_by('-date', '-id')
+        page_obj = Paginator(customer_metrics, self.paginate_by).get_page(request.GET.get('page'))
+
+        # In Python for the page rows: SQLite divides whole-valued decimals as integers
+        for customer in page_obj:
+            customer.percentage_lost = Decimal('0.00')
+            if customer.material_quantity:
+                customer.percentage_lost = customer.total_material_lost * 100 / customer.material_quantity
+
+        return render(request, self.template_name, {
+            'customer_metrics': page_obj,
+            'page_obj': page_obj,
+            'form': form,
+        })
 
 
 class RecyclingDetailView(LoginRequiredMixin, DetailView):
     model = RecyclingOperation
     template_name = 'recycling/recycling-detail2.html'
 
+    def get_queryset(self):
+        return RecyclingOperation.objects.select_related('user', 'meter_ID', 'customer_serial__rollup')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        recycling_operation = self.object
+        customer_in = self.object.customer_serial
+        material_quantity = customer_in.material_quantity
 
-        # Calculate material_lost and percentage_lost
-        material_used = recycling_operation.material_used
-        bangori = recycling_operation.bangori
-        material_quantity = recycling_operation.customer_serial.material_quantity
-        material_lost = material_quantity - (material_used + bangori)
+        # Loss on this operation alone, and across every operation on the intake from its rollup row
+        material_lost = material_quantity - (self.object.material_used + self.object.bangori)
+        try:
+            intake_material_lost = customer_in.rollup.material_lost
+        except CustomerInRollup.DoesNotExist:
+            intake_material_lost = material_lost
 
-        if material_quantity:
-            percentage_lost = (material_lost / material_quantity) * 100
-        else:
-            percentage_lost = 0
+        def percentage(lost):
+            return (lost / material_quantity) * 100 if material_quantity else 0
 
         # Include the calculated values in the context
         context['material_lost'] = material_lost
-        context['percentage_lost'] = percentage_lost
+        context['percentage_lost'] = percentage(material_lost)
+        context['intake_material_lost'] = intake_material_lost
+        context['intake_percentage_lost'] = percentage(intake_material_lost)
 
         return context
 
 
-class SalaryListView(LoginRequiredMixin, TemplateView):
+class SalaryListView(LoginRequiredMixin, ListView):
     template_name = 'salary/salary-list.html'
+    context_object_name = 'salaries'
+    paginate_by = 50
+
+    def get_queryset(self):
+        return Salary.objects.select_related('staff').order_by('staff__role', 'staff__name', 'id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Fetch salaries from all three models
-        managers = SalaryManager.objects.all()
-        operators = SalaryOperator.objects.all()
-        packers = SalaryPacker.objects.all()
+        # Total per role in one grouped query
+        totals = dict(Salary.objects.order_by().values_list('staff__role').annotate(total=Sum('amount1')))
 
-        context['salaries'] = list(managers) + list(operators) + list(packers)
-
-        # Calculate total salaries for each group
-        total_manager_salary = sum(manager.amount1 for manager in managers)
-        total_operator_salary = sum(operator.amount1 for operator in operators)
-        total_packer_salary = sum(packer.amount1 for packer in packers)
-
-        context['total_manager_salary'] = total_manager_salary
-        context['total_operator_salary'] = total_operator_salary
-        context['total_packer_salary'] = total_packer_salary
+        context['total_manager_salary'] = totals.get('manager') or Decimal('0.0')
+        context['total_operator_salary'] = totals.get('operator') or Decimal('0.0')
+        context['total_packer_salary'] = totals.get('packer') or Decimal('0.0')
 
         return context
 
@@ -412,206 +477,171 @@ class RecyclingListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     template_name = 'recycling/recycling-list.html'
     permission_required = 'recycling.view_recycling'
     context_object_name = 'recycling'
-    ordering = ['-created_at']
     paginate_by = 5  # Number of items per page
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(user=self.request.user)
-
-        return queryset
+        return RecyclingOperation.objects.filter(user=self.request.user).select_related(
+            'meter_ID', 'customer_serial__customer',
+        )
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        paginator = Paginator(self.get_queryset(), self.paginate_by)
-        page_number = self.request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
-        context['recycling'] = page_obj
-        return context
+    def paginate_queryset(self, queryset, page_size):
+        # Keyset pagination on the (user, created_at, id) index: deep pages cost the same as the first
+        page = paginate_keyset(
+            queryset, ('created_at', 'id'), page_size, descending=True,
+            after=self.request.GET.get('after'), before=self.request.GET.get('before'),
+        )
+        return None, page, page.object_list, page.has_next or page.has_previous
 
 
 # Accounts Payable
 
 class PayableListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
-    model = AccountPayable
-    permission_required = 'payable.view_payable-list'
+    permission_required = 'operations.view_accountpayable'
     template_name = 'payable/payable-list.html'  # Create a template for displaying the list
     context_object_name = 'payable'  # The variable name to use in the template for the list of payables
+    paginate_by = 50
 
     def get_queryset(self):
-        if self.request.user.is_superuser:
-            # Superuser can see all data
-            return AccountPayable.objects.all()
-        else:
-            # Regular users can see their own data
-            return AccountPayable.objects.filter(user=self.request.user)
+        # Cached aging rows, one per customer with an outstanding balance
+        return payables_aging()
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        rows = self.object_list
+        context['totals'] = {
+            field: sum((getattr(row, field) for row in rows), Decimal('0.00'))
+            for field in ('current', 'days_31_60', 'days_61_90', 'over_90', 'balance')
+        }
+        return context
 
-class PaymentCreateView(LoginRequiredMixin, CreateView):
-    model = Payment
-    template_name = 'payable/create-payment.html'
-    fields = ['customer', 'amount', 'description']
-    success_url = reverse_lazy('payment-list')
-
-    def form_valid(self, form):
-        # Save the Payment instance
-        self.object = form.save()
-
-        # Update the AccountPayable model
-        customer = form.cleaned_data.get('customer')
-        amount = form.cleaned_data.get('amount')
-
-        # Check if there is an existing AccountPayable instance for the customer
-        try:
-            account_payable = AccountPayable.objects.get(customer=customer)
-        except AccountPayable.DoesNotExist:
-            # If no existing AccountPayable instance is found, create one
-            account_payable = AccountPayable.objects.create(customer=customer, amount=0)
 
-        # Decrease the customer's amount in AccountPayable by the payment amount
-        account_payable.amount -= amount
-        account_payable.save()
+class CustomerStatementView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+    permission_required = 'operations.view_accountpayable'
+    template_name = 'payable/customer-statement.html'
+    paginate_by = 50
 
-        # Redirect to the success URL
-        return HttpResponseRedirect(self.get_success_url())
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        customer = get_object_or_404(Customer, pk=self.kwargs['pk'])
+        rows, opening_balance, next_cursor = customer_statement(
+            customer, self.request.GET.get('after'), self.paginate_by
+        )
+        context.update({
+            'customer': customer,
+            'statement': rows,
+            'opening_balance': opening_balance,
+            'next_cursor': next_cursor,
+        })
+        return context
 
 
-class ManagerSalaryCreateView(LoginRequiredMixin, CreateView):
-    model = ManagerSalaryPayment
-    template_name = 'salary/manager-salary-create.html'
-    fields = ['manager', 'amount1', 'description']
-    success_url = reverse_lazy('salary-list')
+class CustomerStatementExportView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    permission_required = 'operations.view_accountpayable'
+    chunk_size = 2000
 
-    def form_valid(self, form):
-        manager = form.cleaned_data['manager']
-        amount1 = form.cleaned_data['amount1']
-        transaction_type = 'debit'  # You may want to specify the transaction type here.
+    def get(self, request, pk):
+        form = ExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
 
-        # Create a transaction for manager's salary
-        general_expenses_account = GeneralExpensesAccount.objects.first()
-        Transaction.objects.create(
-            account=general_expenses_account,
-            amount=amount1,
-            description=form.cleaned_data['description'],
-            transaction_type=transaction_type,
+        customer = get_object_or_404(Customer, pk=pk)
+        rows = (
+            (row.entry_at, 'payment' if row.kind else 'charge', row.description, row.charge, row.payment, row.balance)
+            for row in iter_customer_statement(customer, self.chunk_size)
+        )
+        return streaming_export(
+            f'statement-{customer.pk}',
+            form.cleaned_data['file_format'] or 'csv',
+            ['date', 'entry', 'description', 'charge', 'payment', 'balance'],
+            rows,
+            compress=form.cleaned_data['compress'],
         )
-
-        try:
-            manager_salary = SalaryManager.objects.get(manager=manager)
-            if transaction_type == 'debit':
-                manager_salary.amount1 -= amount1
-            else:
-                manager_salary.amount1 += amount1
-            manager_salary.save()
-        except SalaryManager.DoesNotExist:
-            pass
-
-        if transaction_type == 'debit':
-            general_expenses_account.balance -= amount1
-        else:
-            general_expenses_account.balance += amount1
-        general_expenses_account.save()
-
-        return super().form_valid(form)
 
 
-class OperatorSalaryCreateView(LoginRequiredMixin, CreateView):
-    model = OperatorSalaryPayment
-    template_name = 'salary/operator-salary-create.html'
-    fields = ['operator', 'amount1', 'description']
-    success_url = reverse_lazy('salary-list')
+class PaymentCreateView(LoginRequiredMixin, CreateView):
+    model = Payment
+    template_name = 'payable/create-payment.html'
+    fields = ['customer', 'amount', 'description']
+    success_url = reverse_lazy('payment-list')
 
     def form_valid(self, form):
-        operator = form.cleaned_data['operator']
-        amount1 = form.cleaned_data['amount1']
-        transaction_type = 'debit'  # You may want to specify the transaction type here.
-
-        # Create a transaction for manager's salary
-        general_expenses_account = GeneralExpensesAccount.objects.first()
-        Transaction.objects.create(
-            account=general_expenses_account,
-            amount=amount1,
-            description=form.cleaned_data['description'],
-            transaction_type=transaction_type,
-        )
-
-        try:
-            operator_salary = SalaryOperator.objects.get(operator=operator)
-            if transaction_type == 'debit':
-                operator_salary.amount1 -= amount1
-            else:
-                operator_salary.amount1 += amount1
-            operator_salary.save()
-        except SalaryOperator.DoesNotExist:
-            pass
+        # Save the Payment and decrease the customer's AccountPayable by its amount
+        self.object = record_payment(form.instance)
+        return HttpResponseRedirect(self.get_success_url())
 
-        if transaction_type == 'debit':
-            general_expenses_account.balance -= amount1
-        else:
-            general_expenses_account.balance += amount1
-        general_expenses_account.save()
 
-        return super().form_valid(form)
+class SalaryPaymentCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
+    model = SalaryPayment
+    permission_required = 'operations.add_salarypayment'
+    template_name = 'salary/salary-payment-create.html'
+    fields = ['staff', 'amount1', 'description']
+    success_url = reverse_lazy('salary-list')
+    role = None  # Limits the staff choices when set, e.g. as_view(role='manager')
 
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        if self.role:
+            form.fields['staff'].queryset = Staff.objects.filter(role=self.role).order_by('name')
+        return form
 
-class PackerSalaryCreateView(LoginRequiredMixin, CreateView):
-    model = PackerSalaryPayment
-    template_name = 'salary/packer-salary-create.html'
-    fields = ['packer', 'amount1', 'description']
-    success_url = reverse_lazy('salary-list')
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['role'] = dict(STAFF_ROLES).get(self.role, 'Staff')
+        return context
 
     def form_valid(self, form):
-        packer = form.cleaned_data['packer']
+        staff = form.cleaned_data['staff']
         amount1 = form.cleaned_data['amount1']
-        transaction_type = 'debit'  # You may want to specify the transaction type here.
-
-        # Create a transaction for manager's salary
-        general_expenses_account = GeneralExpensesAccount.objects.first()
-        Transaction.objects.create(
-            account=general_expenses_account,
-            amount=amount1,
-            description=form.cleaned_data['description'],
-            transaction_type=transaction_type,
-        )
 
         try:
-            packer_salary = SalaryPacker.objects.get(packer=packer)
-            if transaction_type == 'debit':
-                packer_salary.amount1 -= amount1
-            else:
-                packer_salary.amount1 += amount1
-            packer_salary.save()
-        except SalaryPacker.DoesNotExist:
-            pass
+            with transaction.atomic():
+                # Pay the salary out of the GeneralExpensesAccount
+                post_transaction(amount1, 'debit', form.cleaned_data['description'])
+                accrue(Salary, {'staff': staff}, 'amount1', -amount1)
+                return super().form_valid(form)
+        except InsufficientBalance:
+            return HttpResponseBadRequest("Insufficient balance to pay the salary.")
+
+
+class SalaryDisbursementView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
+    permission_required = 'operations.add_salarypayment'
+    template_name = 'salary/pay-all-salaries.html'
+    form_class = SalaryDisbursementForm
+    success_url = reverse_lazy('salary-list')
 
-        if transaction_type == 'debit':
-            general_expenses_account.balance -= amount1
-        else:
-            general_expenses_account.balance += amount1
-        general_expenses_account.save()
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        totals = {
+            row['staff__role']: row for row in Salary.objects.filter(amount1__gt=0).order_by().values('staff__role')
+            .annotate(total=Sum('amount1'), count=models.Count('pk'))
+        }
+        outstanding = [(label, totals.get(role, {'total': None, 'count': 0})) for role, label in STAFF_ROLES]
+        context['outstanding'] = outstanding
+        context['total_outstanding'] = sum((totals['total'] or 0 for _, totals in outstanding), Decimal('0.0'))
+        return context
 
+    def form_valid(self, form):
+        try:
+            pay_outstanding_salaries(form.cleaned_data['description'])
+        except InsufficientBalance:
+            return HttpResponseBadRequest("Insufficient balance to pay the salaries.")
         return super().form_valid(form)
 
 
 class CustomerInCreateView(LoginRequiredMixin, CreateView):
     model = CustomerIn
     template_name = 'recycling/create-customerin.html'
-    fields = ['customer_serial', 'customer', 'material_type', 'material_quantity', 'date']
+    fields = ['customer', 'material_type', 'material_quantity', 'date']
     success_url = reverse_lazy('index')
 
     def form_valid(self, form):
-        # Check if a CustomerIn instance with the same customer_serial already exists
-        customer_serial = form.cleaned_data.get('customer_serial')
-        existing_customerin = CustomerIn.objects.filter(customer_serial=customer_serial).first()
-
-        if existing_customerin:
-            # If it already exists, raise a validation error
-            form.add_error('customer_serial', forms.ValidationError('Serial no already exists'))
+        # The serial comes from this worker's reserved block
+        try:
+            self.object = save_with_serial(form, 'customer_serial', next_customer_serial)
+        except IntegrityError:
+            form.add_error(None, forms.ValidationError('Could not allocate a serial number, please try again'))
             return self.form_invalid(form)
-        else:
-            # If it doesn't exist, create a new CustomerIn instance
-            form.instance = form.save()
-
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class CustomerOutView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
@@ -619,58 +649,35 @@ class CustomerOutView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     permission_required = 'recycling.view_customerout_list'
     template_name = 'recycling/customerout-list.html'
     context_object_name = 'customerout_list'
+    paginate_by = 20
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        # Get unique customer_serial values
-        unique_customer_serials = CustomerIn.objects.values_list('customer_serial', flat=True).distinct()
-
-        customer_recycling_data = []
-
-        for customer_serial in unique_customer_serials:
-            customer_recycling = RecyclingOperation.objects.filter(customer_serial=customer_serial)
-
-            # Calculate material_lost for each RecyclingOperation
-            for recycling in customer_recycling:
-                recycling.material_lost = recycling.customer_serial.material_quantity - (
-                        recycling.material_used + recycling.bangori)
-
-            customer_recycling_data.append({
-                'customer_serial': customer_serial,
-                'customer_recycling': customer_recycling,
-            })
-
-        context['customer_recycling_data'] = customer_recycling_data
-        return context
+    def get_queryset(self):
+        # One query for the page of intakes and one for all of their operations, with material_lost from the DB
+        operations = RecyclingOperation.objects.annotate(
+            material_lost=ExpressionWrapper(
+                F('customer_serial__material_quantity') - F('material_used') - F('bangori'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        ).order_by('created_at', 'id')
+        return CustomerIn.objects.select_related('customer', 'rollup').prefetch_related(
+            Prefetch('recyclingoperation_set', queryset=operations, to_attr='customer_recycling'),
+        ).order_by('customer_serial', 'id')
 
 
 class FlakesInCreateView(CreateView):
     model = FlakesIn
-    fields = ['date', 'serial', 'flakes_type', 'flakes_quantity', 'unit_cost']
+    fields = ['date', 'flakes_type', 'flakes_quantity', 'unit_cost']
     template_name = 'flakes/create-flakes_in.html'
     success_url = reverse_lazy('index')
 
     def form_valid(self, form):
-        form.instance.user = self.request.user
-
-        # Check if a FlakesIn instance with the same serial already exists
-        serial = form.cleaned_data.get('serial')
-        existing_flakesin = FlakesIn.objects.filter(serial=serial).first()
-
-        if existing_flakesin:
-            # If it already exists, raise a validation error
-            form.add_error('serial', forms.ValidationError('Serial number already exists'))
-            return self.form_invalid(form)
-
-        # First, validate the form
-        if not form.is_valid():
-            return self.form_invalid(form)
-
-        # Perform additional actions if the form is valid
         self.calculate_total_cost(form)
-        self.object = form.save()
-
+        # The serial comes from this worker's reserved block
+        try:
+            self.object = save_with_serial(form, 'serial', next_flakes_serial)
+        except IntegrityError:
+            form.add_error(None, forms.ValidationError('Could not allocate a serial number, please try again'))
+            return self.form_invalid(form)
         return HttpResponseRedirect(self.get_success_url())
 
     def calculate_total_cost(self, form):
@@ -683,13 +690,6 @@ class FlakesInCreateView(CreateView):
         else:
             form.instance.total_cost1 = None
 
-    def form_invalid(self, form):
-        try:
-            form.instance.full_clean()
-        except ValidationError as e:
-            form.add_error(None, e)
-        return super().form_invalid(form)
-
 
 class FlakesInListView(ListView):
     model = FlakesIn
@@ -790,13 +790,23 @@ class PelletsPriceListView(ListView):
     paginate_by = 10  # Number of items per page
 
     def get_queryset(self):
-        # Customize the queryset if needed (filtering, ordering, etc.)
-        return PelletsPrice.objects.all().order_by('-date')  # Example ordering by date
+        # The template shows each sale's flakes, so they come in the same query
+        return PelletsPrice.objects.select_related('serial', 'cost_id').order_by('-date', '-id')
 
-    def get_queryset(self):
-        if self.request.user.is_superuser:
-            # Superuser can see all data
-            return PelletsPrice.objects.all().order_by('-date')
-        else:
-            # Regular users can see their own data
-            return PelletsPrice.objects.filter(user=self.request.user)
\ No newline at end of file
+
+class PelletsProfitabilityView(LoginRequiredMixin, TemplateView):
+    template_name = 'flakes/pellets-profitability.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = PelletsReportForm(self.request.GET or {'year': timezone.localdate().year})
+        context['form'] = form
+
+        if form.is_valid():
+            rows = pellets_profitability(form.cleaned_data['year'])
+            flakes_type = form.cleaned_data['flakes_type']
+            if flakes_type:
+                rows = [row for row in rows if row.flakes_type.lower() == flakes_type.lower()]
+            context['rows'] = rows
+            context['totals'] = profitability_totals(rows)
+        return context